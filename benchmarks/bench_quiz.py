@@ -0,0 +1,363 @@
+"""クイズのホットパスのベンチマーク
+
+OpenAIとGoogle Sheetsをローカルのフェイクに置き換え、AppTestで
+ログイン → 15問回答 → 結果画面 の流れを実行して操作ごとの遅延を計測する。
+load_dataとget_logsは関数を直接呼び出して計測する。
+
+使い方:
+    python -m benchmarks.bench_quiz --sessions 5 --openai-latency 0.2 --sheets-latency 0.05
+    python -m benchmarks.bench_quiz --save-baseline bench_baseline.json
+    python -m benchmarks.bench_quiz --baseline bench_baseline.json --max-regression 0.25
+
+--baselineを指定した場合、p95遅延（悪化率と悪化幅の両方が閾値を超えたもの）・
+再実行回数・外部呼び出し回数が基準値より悪化していれば終了コード1で終了する（CI用）。
+"""
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from functools import wraps
+
+from benchmarks.fakes import (
+    CallCounter, FakeOpenAI, FakeSheetsService, LatencyModel,
+    install_fakes, use_fake_secrets,
+)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT_DIR, 'streamlit_app.py')
+
+# 回帰と判定するp95遅延の最小の悪化幅（ミリ秒）。スケジューラの揺れで数ms悪化しても失敗させない
+MIN_REGRESSION_MS = 20.0
+
+# 1回答あたりの回数で許容する増加率。評価完了のポーリングで再実行・ログ送信の回数が
+# 実行ごとに数%揺れるため、それを超える増加だけを回帰とする
+MAX_COUNT_INCREASE = 0.1
+
+# 評価ジョブの完了を確認する間隔（秒）。画面の間隔より短くして待ち時間を正確に測る
+EVALUATION_POLL_SECONDS = 0.01
+
+
+def percentile(values, q):
+    """最近傍法によるパーセンタイル"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
+
+
+class Recorder:
+    """操作ごとの遅延と関数の呼び出し回数を記録する（スレッドセーフ）"""
+    def __init__(self):
+        self.timings = {}
+        self.calls = CallCounter()
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.timings.setdefault(name, []).append(seconds)
+
+    def time(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def wrap(self, module, name):
+        """モジュールの関数を呼び出し回数と所要時間を記録するラッパーに置き換える"""
+        original = getattr(module, name)
+
+        @wraps(original)
+        def wrapper(*args, **kwargs):
+            self.calls.add(name)
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(f'fn:{name}', time.perf_counter() - start)
+
+        setattr(module, name, wrapper)
+
+
+def setup_environment(args):
+    """フェイクとベンチマーク用の共有ストアを準備する"""
+    state_dir = tempfile.mkdtemp(prefix='quiz_bench_')
+    os.environ['QUIZ_STATE_DB'] = os.path.join(state_dir, 'quiz_state.db')
+    os.environ['QUIZ_EVALUATION_PROFILE'] = args.profile
+    os.chdir(ROOT_DIR)
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+
+    openai_fake = FakeOpenAI(
+        latency=LatencyModel(args.openai_latency, tail_ratio=args.tail_ratio, seed=args.seed),
+        seed=args.seed
+    )
+    sheets_fake = FakeSheetsService(
+        latency=LatencyModel(args.sheets_latency, tail_ratio=args.tail_ratio, seed=args.seed)
+    )
+    install_fakes(openai_fake, sheets_fake)
+    use_fake_secrets()
+    return openai_fake, sheets_fake
+
+
+def click(at, label):
+    """ラベルでボタンを探してクリック"""
+    for button in at.button:
+        if button.label == label:
+            return button.click()
+    errors = [exception.message for exception in at.exception]
+    raise AssertionError(f"ボタンが見つかりません: {label} (例外: {errors})")
+
+
+def clear_state_store():
+    """評価キャッシュと保存済みの進捗を空にする"""
+    from utils.session_store import get_session_store
+
+    with get_session_store()._connect() as conn:
+        conn.execute("DELETE FROM evaluation_cache")
+        conn.execute("DELETE FROM session_snapshots")
+
+
+def run_session(nickname, recorder, max_questions, think_time=None, answer_offset=0, exam_mode=False):
+    """1ユーザー分のクイズを最後まで進める
+
+    think_timeにLatencyModelを渡すと、操作の間にユーザーの思考時間を挟む。
+    answer_offsetを変えるとユーザーごとに異なる選択肢を選ぶ。
+    exam_modeをTrueにすると試験モードで回答し、最後にまとめて採点する。
+    """
+    from streamlit.testing.v1 import AppTest
+
+    # st.secretsはsetup_environmentでフェイクに置き換え済み
+    at = AppTest.from_file(APP_PATH, default_timeout=600)
+
+    def wait_for_evaluation():
+        # 評価はバックグラウンドのジョブで行われ、画面は完了までポーリングする
+        while any(info.icon == '⏳' for info in at.info):
+            time.sleep(EVALUATION_POLL_SECONDS)
+            at.run()
+
+    def step(name):
+        if think_time is not None:
+            think_time.wait()
+        recorder.time(name, at.run)
+        recorder.time(f'{name}_wait', wait_for_evaluation)
+
+    recorder.time('initial_load', at.run)
+
+    at.text_input[0].input(nickname)
+    if exam_mode:
+        at.checkbox[0].check()
+    click(at, '開始')
+    step('login')
+
+    for i in range(max_questions):
+        radio = at.radio[0]
+        radio.set_value(radio.options[(i + answer_offset) % len(radio.options)])
+        click(at, '回答を確定する')
+        step('answer')
+        if i < max_questions - 1:
+            click(at, '次の問題へ ➡️')
+            step('next_question')
+
+    click(at, '結果を見る🎖️')
+    step('result')
+
+    if at.exception:
+        raise AssertionError(f"アプリで例外が発生しました: {at.exception[0].message}")
+    if not at.title or at.title[0].value != '🙌クイズ完了':
+        raise AssertionError("結果画面に到達しませんでした")
+
+
+def bench_load_data(recorder, iterations):
+    """load_dataのコールド（キャッシュなし）とウォームの読み込み時間"""
+    import streamlit_app
+
+    for _ in range(iterations):
+        # 直前のセッションで溜まったオブジェクトのGCが計測中に走らないよう先に回収する
+        gc.collect()
+        streamlit_app.load_data.clear()
+        recorder.time('load_data_cold', streamlit_app.load_data)
+        recorder.time('load_data_warm', streamlit_app.load_data)
+
+
+def bench_get_logs(recorder, sheets_fake, rows, iterations):
+    """get_logsとログ行の解析時間"""
+    from utils.logger import get_logs
+    from utils.log_parser import parse_log_lines
+
+    sheets_fake.sheets['logs'] = [['Log Message']]
+    sheets_fake.preload_logs(rows)
+    for _ in range(iterations):
+        gc.collect()
+        logs = recorder.time('get_logs', get_logs, spreadsheet_id='fake-spreadsheet', limit=rows)
+        recorder.time('parse_log_lines', parse_log_lines, logs)
+
+
+def gpt_token_totals():
+    """評価プロファイルが記録したトークン数の合計"""
+    from utils.metrics import registry
+
+    totals = {'quiz_gpt_prompt_tokens_total': 0.0, 'quiz_gpt_completion_tokens_total': 0.0}
+    counters, _ = registry.snapshot()
+    for counter in counters:
+        if counter['name'] in totals:
+            totals[counter['name']] += counter['value']
+    return totals
+
+
+def run_benchmark(args):
+    openai_fake, sheets_fake = setup_environment(args)
+
+    import components.quiz as quiz
+    from utils.metrics import registry
+
+    # スレッドプールの起動など初回だけの処理を計測から除くため、記録しないセッションを先に1回実行する
+    run_session('warmup', Recorder(), quiz.MAX_QUESTIONS, exam_mode=args.exam_mode)
+    clear_state_store()
+    registry.reset()
+
+    recorder = Recorder()
+    for name in ('show_quiz_screen', 'handle_answer', 'process_answer', 'record_exam_answer', 'grade_exam_answers'):
+        recorder.wrap(quiz, name)
+
+    openai_fake.calls.reset()
+    sheets_fake.calls.reset()
+    for i in range(args.sessions):
+        if not args.warm_cache:
+            # 評価キャッシュを空にして毎回GPT呼び出しを発生させる
+            clear_state_store()
+        # 前のセッションのオブジェクトを回収してから、読み込み済みのモジュールなどをGCの対象外にする
+        # （世代2のGCが計測中の操作に入り、p95が実行ごとに大きく揺れるのを防ぐ）
+        gc.collect()
+        gc.freeze()
+        run_session(f"bench{i}", recorder, quiz.MAX_QUESTIONS, exam_mode=args.exam_mode)
+
+    answers = args.sessions * quiz.MAX_QUESTIONS
+    tokens = gpt_token_totals()
+    openai_calls = openai_fake.calls.snapshot()
+    sheets_calls = sheets_fake.calls.snapshot()
+    quiz_calls = recorder.calls.snapshot()
+
+    bench_load_data(recorder, args.iterations)
+    bench_get_logs(recorder, sheets_fake, args.log_rows, args.iterations)
+
+    return {
+        'config': {
+            'sessions': args.sessions,
+            'profile': args.profile,
+            'exam_mode': args.exam_mode,
+            'openai_latency': args.openai_latency,
+            'sheets_latency': args.sheets_latency,
+            'warm_cache': args.warm_cache,
+            'log_rows': args.log_rows,
+        },
+        'latency': {name: summarize(values) for name, values in sorted(recorder.timings.items())},
+        'per_answer': {
+            'reruns': quiz_calls.get('show_quiz_screen', 0) / answers,
+            'openai_calls': openai_calls.get('chat.completions.create', 0) / answers,
+            'sheets_calls': sum(sheets_calls.values()) / answers,
+            'prompt_tokens': tokens['quiz_gpt_prompt_tokens_total'] / answers,
+            'completion_tokens': tokens['quiz_gpt_completion_tokens_total'] / answers,
+        },
+        'external_calls': {'openai': openai_calls, 'sheets': sheets_calls},
+    }
+
+
+def print_report(report):
+    print(f"{'interaction':<28}{'count':>7}{'p50(ms)':>11}{'p95(ms)':>11}{'p99(ms)':>11}")
+    for name, stats in report['latency'].items():
+        print(f"{name:<28}{stats['count']:>7}"
+              f"{stats['p50'] * 1000:>11.1f}{stats['p95'] * 1000:>11.1f}{stats['p99'] * 1000:>11.1f}")
+    print()
+    for name, value in report['per_answer'].items():
+        print(f"{name} per answer: {value:.2f}")
+
+
+def compare_with_baseline(report, baseline, max_regression, min_regression_ms=MIN_REGRESSION_MS,
+                          max_count_increase=MAX_COUNT_INCREASE):
+    """基準値と比較して悪化した項目のリストを返す
+
+    p95遅延は悪化率がmax_regressionを超え、かつ悪化幅がmin_regression_msを超えた場合に、
+    1回答あたりの回数は増加率がmax_count_increaseを超えた場合に回帰とする。
+    """
+    regressions = []
+    for name, stats in baseline.get('latency', {}).items():
+        current = report['latency'].get(name)
+        if current is None:
+            continue
+        if (current['p95'] > stats['p95'] * (1 + max_regression)
+                and (current['p95'] - stats['p95']) * 1000 > min_regression_ms):
+            regressions.append(
+                f"{name}: p95 {stats['p95'] * 1000:.1f}ms -> {current['p95'] * 1000:.1f}ms"
+            )
+    for name, value in baseline.get('per_answer', {}).items():
+        current = report['per_answer'].get(name, 0)
+        if current > value * (1 + max_count_increase) + 1e-9:
+            regressions.append(f"{name} per answer: {value:.2f} -> {current:.2f}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="クイズのホットパスのベンチマーク")
+    parser.add_argument('--sessions', type=int, default=3, help="実行するクイズセッション数")
+    parser.add_argument('--iterations', type=int, default=5, help="load_data/get_logsの計測回数")
+    parser.add_argument('--openai-latency', type=float, default=0.0, help="フェイクOpenAIの平均遅延（秒）")
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help="フェイクSheetsの平均遅延（秒）")
+    parser.add_argument('--exam-mode', action='store_true', help="試験モードで回答し、最後にまとめて採点する")
+    parser.add_argument('--profile', default='classic', help="評価プロファイル（utils/gpt.pyのEVALUATION_PROFILES）")
+    parser.add_argument('--tail-ratio', type=float, default=0.0, help="フェイクの遅延が5倍になる確率")
+    parser.add_argument('--log-rows', type=int, default=10000, help="get_logsで読み込むログ行数")
+    parser.add_argument('--warm-cache', action='store_true', help="セッション間で評価キャッシュを保持する")
+    parser.add_argument('--seed', type=int, default=0, help="遅延の乱数シード")
+    parser.add_argument('--output', help="結果をJSONで保存するパス")
+    parser.add_argument('--save-baseline', help="結果を基準値として保存するパス")
+    parser.add_argument('--baseline', help="比較する基準値JSONのパス")
+    parser.add_argument('--max-regression', type=float, default=0.25, help="許容するp95の悪化率")
+    parser.add_argument('--min-regression-ms', type=float, default=MIN_REGRESSION_MS,
+                        help="回帰と判定するp95の最小の悪化幅（ミリ秒）")
+    parser.add_argument('--max-count-increase', type=float, default=MAX_COUNT_INCREASE,
+                        help="許容する1回答あたりの再実行・外部呼び出し回数の増加率")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(
+            report, baseline, args.max_regression, args.min_regression_ms, args.max_count_increase
+        )
+        if regressions:
+            print("\n性能が悪化しました:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n基準値からの悪化はありません")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
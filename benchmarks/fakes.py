@@ -0,0 +1,281 @@
+"""ベンチマーク・負荷試験用の外部サービスのフェイク
+
+OpenAI APIとGoogle Sheets APIをローカルのフェイクに置き換え、
+設定した遅延で応答しつつ呼び出し回数を記録する。
+"""
+import re
+import math
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+
+class LatencyModel:
+    """フェイクの応答遅延（秒）を生成する
+
+    平均meanの対数正規分布に従い、確率tail_ratioでtail_factor倍の遅延を返す。
+    """
+    def __init__(self, mean=0.0, sigma=0.3, tail_ratio=0.0, tail_factor=5.0, seed=None):
+        self.mean = mean
+        self.sigma = sigma
+        self.tail_ratio = tail_ratio
+        self.tail_factor = tail_factor
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        if self.mean <= 0:
+            return 0.0
+        with self._lock:
+            # 平均がmeanになるように対数正規分布のmuを調整
+            value = self._random.lognormvariate(0, self.sigma) * self.mean / math.exp(self.sigma ** 2 / 2)
+            if self._random.random() < self.tail_ratio:
+                value *= self.tail_factor
+        return value
+
+    def wait(self):
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class CallCounter:
+    """スレッドセーフな呼び出し回数カウンタ"""
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+class InFlightGauge:
+    """同時実行中の呼び出し数とその最大値を記録する"""
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._lock:
+            self.current -= 1
+        return False
+
+
+class _Request:
+    """googleapiclientのHttpRequestと同じくexecute()で実行されるリクエスト"""
+    def __init__(self, func):
+        self._func = func
+
+    def execute(self):
+        return self._func()
+
+
+class FakeSheetsValues:
+    def __init__(self, service):
+        self._service = service
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return _Request(lambda: self._service._call('values.update', lambda: self._service._update(range, body)))
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        return _Request(lambda: self._service._call('values.append', lambda: self._service._append(range, body)))
+
+    def get(self, spreadsheetId, range):
+        return _Request(lambda: self._service._call('values.get', lambda: self._service._get(range)))
+
+
+class FakeSheetsService:
+    """service.spreadsheets() が返すコネクタのフェイク（シートはメモリ上に保持）"""
+    def __init__(self, latency=None):
+        self.latency = latency or LatencyModel()
+        self.calls = CallCounter()
+        self.in_flight = InFlightGauge()
+        self.sheets = {}
+        self._lock = threading.Lock()
+
+    def spreadsheets(self):
+        return self
+
+    def _call(self, name, func):
+        self.calls.add(name)
+        with self.in_flight:
+            self.latency.wait()
+            with self._lock:
+                return func()
+
+    @staticmethod
+    def _sheet_name(cell_range):
+        return cell_range.split('!')[0]
+
+    def _update(self, cell_range, body):
+        rows = self.sheets.setdefault(self._sheet_name(cell_range), [])
+        values = body['values']
+        rows[:len(values)] = values
+        return {}
+
+    def _append(self, cell_range, body):
+        self.sheets.setdefault(self._sheet_name(cell_range), []).extend(body['values'])
+        return {}
+
+    def _get(self, cell_range):
+        return {'values': list(self.sheets.get(self._sheet_name(cell_range), []))}
+
+    def get(self, spreadsheetId):
+        def spreadsheet():
+            return {'sheets': [
+                {'properties': {'title': name, 'sheetId': sheet_id}}
+                for sheet_id, name in enumerate(self.sheets)
+            ]}
+        return _Request(lambda: self._call('get', spreadsheet))
+
+    def batchUpdate(self, spreadsheetId, body):
+        def batch_update():
+            for request in body.get('requests', []):
+                if 'addSheet' in request:
+                    self.sheets.setdefault(request['addSheet']['properties']['title'], [])
+                if 'deleteDimension' in request:
+                    dimension_range = request['deleteDimension']['range']
+                    name = list(self.sheets)[dimension_range['sheetId']]
+                    del self.sheets[name][dimension_range['startIndex']:dimension_range['endIndex']]
+            return {}
+        return _Request(lambda: self._call('batchUpdate', batch_update))
+
+    def values(self):
+        return FakeSheetsValues(self)
+
+    def preload_logs(self, count, sheet_name='logs', users=50, start_at=None, interval_seconds=1.0):
+        """get_logsのベンチマーク用に整形済みのログ行を投入
+
+        start_atからinterval_seconds秒ごとの時刻で出力されたログとして追加する。
+        """
+        start_at = start_at or datetime(2024, 10, 29, 15, 0, 0)
+        rows = self.sheets.setdefault(sheet_name, [['Log Message']])
+        for i in range(count):
+            user = f"user{i % users}"
+            created_at = start_at + timedelta(seconds=i * interval_seconds)
+            rows.append([
+                f"{created_at.strftime('%Y-%m-%d %H:%M:%S')} JST - xlsx_data_app_{user} - INFO"
+                f" - ユーザー[{user}] - 正解 - 問題番号: {i % 15 + 1}, ユーザー回答: A"
+            ])
+
+
+class FakeOpenAI:
+    """OpenAIクライアントのフェイク（chat.completions.createのみ実装）
+
+    failure_rateとlatencyは実行中に変更でき、障害の発生・復旧を再現できる。
+    """
+    USER_ANSWER_PATTERN = re.compile(r'ユーザーの回答:\s*(.+)')
+
+    def __init__(self, latency=None, failure_rate=0.0, seed=None):
+        self.latency = latency or LatencyModel()
+        self.failure_rate = failure_rate
+        self.calls = CallCounter()
+        self.in_flight = InFlightGauge()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @staticmethod
+    def _evaluation(user_answer):
+        # 採点の正しさは計測対象外なので、回答の先頭が「B」なら正解として扱う
+        is_correct = user_answer[:1].upper() == 'B'
+        return (
+            f"RESULT:[{'CORRECT' if is_correct else 'INCORRECT'}]\n"
+            f"あなたの回答: {user_answer}\n"
+            f"正解: B\n"
+            f"解説: フェイクの解説です。"
+        )
+
+    def create(self, model=None, messages=None, timeout=None, **kwargs):
+        self.calls.add('chat.completions.create')
+        self.calls.add(f'model:{model}')
+        delay = self.latency.sample()
+        with self.in_flight:
+            # 実際のクライアントと同様にtimeout秒を超える応答はタイムアウトさせる
+            time.sleep(min(delay, timeout) if timeout else delay)
+        if timeout and delay > timeout:
+            self.calls.add('timeout')
+            raise TimeoutError("fake OpenAI timeout")
+        with self._random_lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            self.calls.add('failure')
+            raise ConnectionError("fake OpenAI failure")
+
+        prompt = messages[-1]['content'] if messages else ''
+        user_answers = [answer.strip() for answer in self.USER_ANSWER_PATTERN.findall(prompt)] or ['']
+        blocks = [self._evaluation(answer) for answer in user_answers]
+        if len(blocks) > 1:
+            # 試験モードの一括評価には問題番号の見出し付きで返す
+            content = '\n'.join(f"### 問題{i + 1}\n{block}" for i, block in enumerate(blocks))
+        else:
+            content = blocks[0]
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 2, completion_tokens=len(content) // 2)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage
+        )
+
+
+FAKE_SECRETS = {
+    'gsheet': {'spreadsheet_id': 'fake-spreadsheet'},
+    'spreadsheet_id': 'fake-spreadsheet',
+    'OPENAI_API_KEY': 'fake-key',
+    'connections': {'gcs': {}},
+}
+
+
+def use_fake_secrets(secrets=None):
+    """st.secretsをフェイクの値に置き換える（AppTestと同じ方法）"""
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    fake = Secrets()
+    fake._secrets = dict(secrets or FAKE_SECRETS)
+    st.secrets = fake
+    return fake
+
+
+def install_fakes(openai_fake, sheets_fake):
+    """外部サービスをフェイクに差し替えるパッチを開始し、停止用の関数を返す
+
+    utils配下のモジュールを読み込む前に呼び出すこと。
+    """
+    import openai
+    import google_auth_httplib2
+    import googleapiclient.discovery
+    from google.oauth2 import service_account
+
+    patches = [
+        mock.patch.object(service_account.Credentials, 'from_service_account_info', return_value=object()),
+        mock.patch.object(google_auth_httplib2, 'AuthorizedHttp', return_value=object()),
+        mock.patch.object(googleapiclient.discovery, 'build', return_value=sheets_fake),
+        mock.patch.object(openai, 'OpenAI', return_value=openai_fake),
+    ]
+    for patch in patches:
+        patch.start()
+
+    def uninstall():
+        for patch in reversed(patches):
+            patch.stop()
+
+    return uninstall
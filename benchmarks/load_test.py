@@ -0,0 +1,252 @@
+"""クラス単位の同時利用を想定した負荷試験
+
+N人の仮想ユーザーが同時に ログイン → 15問回答 → 結果画面 を進める。
+OpenAIとGoogle Sheetsは現実的な遅延分布を持つローカルのフェイクに置き換える。
+スループット・操作ごとの遅延・スレッド数・メモリ使用量・外部呼び出し回数と
+その同時実行数の最大値を出力する。
+
+使い方:
+    python -m benchmarks.load_test --users 50 --openai-latency 2.0 --sheets-latency 0.2 2>/dev/null
+    python -m benchmarks.load_test --users 200 --ramp-up 10 --think-time 3 --output load.json
+"""
+import sys
+import json
+import time
+import argparse
+import resource
+import threading
+import traceback
+from unittest import mock
+
+from benchmarks.bench_quiz import Recorder, clear_state_store, run_session, setup_environment, summarize
+from benchmarks.fakes import LatencyModel
+
+
+def current_rss_mb():
+    """現在の常駐メモリ（MB）。/procが使えない環境では最大値で代用"""
+    try:
+        with open('/proc/self/status', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """プロセスの最大常駐メモリ（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト単位
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def share_apptest_runtime():
+    """AppTestを複数スレッドから同時に実行できるようにする
+
+    AppTestは実行ごとにRuntime._instanceをモックに差し替え、終了時にNoneへ
+    戻すため、そのままでは他スレッドの実行中にランタイムが消える。
+    直近に設定されたモックを保持して返すようにRuntimeをパッチする。
+    また、AppTestは実行ごとにスクリプトをコンパイルし直すが、ast.parseは
+    スレッド間で同時に呼ぶと失敗することがあるため、コンパイルを直列化する
+    （実際のサーバーはScriptCacheを共有するため1回しかコンパイルしない）。
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    latest = {}
+    original_instance = Runtime.__dict__['instance'].__func__
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest['runtime'] = cls._instance
+            return cls._instance
+        if 'runtime' in latest:
+            return latest['runtime']
+        return original_instance(cls)
+
+    def exists(cls):
+        return cls._instance is not None or 'runtime' in latest
+
+    # patch_config_optionsの復元で他スレッドの実行中にフラグが戻らないよう固定する
+    config.set_option('global.appTest', True)
+    for name, func in (('instance', instance), ('exists', exists)):
+        mock.patch.object(Runtime, name, classmethod(func)).start()
+
+    compile_lock = threading.Lock()
+    original_get_bytecode = ScriptCache.get_bytecode
+
+    def get_bytecode(self, script_path):
+        with compile_lock:
+            return original_get_bytecode(self, script_path)
+
+    mock.patch.object(ScriptCache, 'get_bytecode', get_bytecode).start()
+
+
+class ResourceMonitor(threading.Thread):
+    """スレッド数とメモリ使用量を定期的に記録する"""
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True, name='ResourceMonitor')
+        self.interval = interval
+        self.samples = []
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.samples.append((time.perf_counter(), threading.active_count(), current_rss_mb()))
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def summary(self):
+        threads = [sample[1] for sample in self.samples] or [threading.active_count()]
+        rss = [sample[2] for sample in self.samples] or [current_rss_mb()]
+        return {
+            'threads_peak': max(threads),
+            'threads_mean': sum(threads) / len(threads),
+            'rss_start_mb': rss[0],
+            'rss_end_mb': rss[-1],
+            'rss_peak_mb': max(max(rss), peak_rss_mb()),
+        }
+
+
+def run_load_test(args):
+    openai_fake, sheets_fake = setup_environment(args)
+    share_apptest_runtime()
+
+    import components.quiz as quiz
+
+    recorder = Recorder()
+    recorder.wrap(quiz, 'show_quiz_screen')
+    think_time = LatencyModel(args.think_time, sigma=0.5, seed=args.seed) if args.think_time > 0 else None
+
+    # アプリのモジュール読み込みとキャッシュの準備を計測対象から外す
+    run_session('warmup', Recorder(), quiz.MAX_QUESTIONS)
+    clear_state_store()
+    openai_fake.calls.reset()
+    sheets_fake.calls.reset()
+
+    if args.disable_eval_cache:
+        # 全ての回答でGPT呼び出しを発生させ、評価処理の競合を最大にする
+        from utils.session_store import SessionStore
+        mock.patch.object(SessionStore, 'get_evaluation', return_value=None).start()
+
+    errors = []
+    start_barrier = threading.Barrier(args.users + 1)
+
+    def virtual_user(index):
+        start_barrier.wait()
+        # ramp_up秒の間に開始時刻を均等に分散させる
+        if args.ramp_up > 0:
+            time.sleep(args.ramp_up * index / args.users)
+        try:
+            run_session(f"load{index}", recorder, quiz.MAX_QUESTIONS, think_time=think_time, answer_offset=index)
+        except Exception:
+            errors.append(traceback.format_exc(limit=3))
+
+    users = [
+        threading.Thread(target=virtual_user, args=(i,), name=f'VirtualUser-{i}', daemon=True)
+        for i in range(args.users)
+    ]
+    for user in users:
+        user.start()
+
+    monitor = ResourceMonitor()
+    monitor.start()
+    start_barrier.wait()
+    started_at = time.perf_counter()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - started_at
+    monitor.stop()
+
+    completed = args.users - len(errors)
+    answers = completed * quiz.MAX_QUESTIONS
+    interactions = sum(
+        len(values) for name, values in recorder.timings.items() if not name.startswith('fn:')
+    )
+    return {
+        'config': {
+            'users': args.users,
+            'profile': args.profile,
+            'ramp_up': args.ramp_up,
+            'think_time': args.think_time,
+            'openai_latency': args.openai_latency,
+            'sheets_latency': args.sheets_latency,
+            'tail_ratio': args.tail_ratio,
+            'disable_eval_cache': args.disable_eval_cache,
+        },
+        'elapsed_seconds': elapsed,
+        'completed_sessions': completed,
+        'failed_sessions': len(errors),
+        'throughput': {
+            'sessions_per_second': completed / elapsed if elapsed else 0.0,
+            'answers_per_second': answers / elapsed if elapsed else 0.0,
+            'interactions_per_second': interactions / elapsed if elapsed else 0.0,
+        },
+        'latency': {name: summarize(values) for name, values in sorted(recorder.timings.items())},
+        'resources': monitor.summary(),
+        'upstream': {
+            'openai_calls': openai_fake.calls.snapshot(),
+            'openai_peak_in_flight': openai_fake.in_flight.peak,
+            'sheets_calls': sheets_fake.calls.snapshot(),
+            'sheets_peak_in_flight': sheets_fake.in_flight.peak,
+        },
+        'errors': errors[:5],
+    }
+
+
+def print_report(report):
+    print(f"users: {report['config']['users']}, elapsed: {report['elapsed_seconds']:.1f}s, "
+          f"completed: {report['completed_sessions']}, failed: {report['failed_sessions']}")
+    throughput = report['throughput']
+    print(f"throughput: {throughput['sessions_per_second']:.2f} sessions/s, "
+          f"{throughput['answers_per_second']:.2f} answers/s, "
+          f"{throughput['interactions_per_second']:.2f} interactions/s")
+    print()
+    print(f"{'interaction':<24}{'count':>7}{'p50(ms)':>11}{'p95(ms)':>11}{'p99(ms)':>11}")
+    for name, stats in report['latency'].items():
+        print(f"{name:<24}{stats['count']:>7}"
+              f"{stats['p50'] * 1000:>11.1f}{stats['p95'] * 1000:>11.1f}{stats['p99'] * 1000:>11.1f}")
+    print()
+    resources = report['resources']
+    print(f"threads: peak {resources['threads_peak']}, mean {resources['threads_mean']:.1f}")
+    print(f"rss: start {resources['rss_start_mb']:.1f}MB, end {resources['rss_end_mb']:.1f}MB, "
+          f"peak {resources['rss_peak_mb']:.1f}MB")
+    upstream = report['upstream']
+    print(f"openai: {upstream['openai_calls']}, peak in flight {upstream['openai_peak_in_flight']}")
+    print(f"sheets: {upstream['sheets_calls']}, peak in flight {upstream['sheets_peak_in_flight']}")
+    for error in report['errors']:
+        print(f"\nerror:\n{error}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="同時利用を想定した負荷試験")
+    parser.add_argument('--users', type=int, default=50, help="仮想ユーザー数")
+    parser.add_argument('--ramp-up', type=float, default=0.0, help="全ユーザーが開始するまでの秒数（0で一斉開始）")
+    parser.add_argument('--think-time', type=float, default=0.0, help="操作間のユーザーの平均思考時間（秒）")
+    parser.add_argument('--openai-latency', type=float, default=2.0, help="フェイクOpenAIの平均遅延（秒）")
+    parser.add_argument('--sheets-latency', type=float, default=0.2, help="フェイクSheetsの平均遅延（秒）")
+    parser.add_argument('--profile', default='classic', help="評価プロファイル（utils/gpt.pyのEVALUATION_PROFILES）")
+    parser.add_argument('--tail-ratio', type=float, default=0.05, help="フェイクの遅延が5倍になる確率")
+    parser.add_argument('--disable-eval-cache', action='store_true', help="GPT評価キャッシュを使わない")
+    parser.add_argument('--seed', type=int, default=0, help="遅延の乱数シード")
+    parser.add_argument('--output', help="結果をJSONで保存するパス")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_load_test(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report['failed_sessions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
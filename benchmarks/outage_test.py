@@ -0,0 +1,213 @@
+"""OpenAI APIの障害時の挙動を確認する試験
+
+フェイクOpenAIに障害を注入し、正常 → 障害発生（検知まで） → 障害中 → 復旧 の
+各フェーズで回答操作の遅延とサーキットブレーカーの状態を計測する。
+障害中も正常時と同程度の速度で応答し、復旧後にブレーカーが閉じることを確認する。
+
+--outage slow_healthyでは障害の代わりに、評価プロファイルの想定の範囲内で遅い応答
+（想定応答時間の1.5倍）を返し、サーキットが開かず縮退モードにならないことを確認する。
+
+使い方:
+    python -m benchmarks.outage_test --outage failures 2>/dev/null
+    python -m benchmarks.outage_test --outage slow --gpt-timeout 1.0 --openai-latency 0.3
+    python -m benchmarks.outage_test --outage slow_healthy --profile classic
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from unittest import mock
+
+from benchmarks.bench_quiz import Recorder, clear_state_store, run_session, setup_environment, summarize
+
+# slow_healthyで返す応答時間の、プロファイルの想定応答時間に対する倍率
+# （gpt-4の想定10秒に対して15秒かかる呼び出しなど、正常な範囲の遅さ）
+SLOW_HEALTHY_FACTOR = 1.5
+
+
+def breaker_counters():
+    """サーキットブレーカーと縮退モードのカウンタ"""
+    from utils.metrics import registry
+
+    totals = {}
+    counters, _ = registry.snapshot()
+    for counter in counters:
+        if counter['name'] == 'quiz_circuit_transitions_total':
+            key = f"transition:{counter['labels']['state']}"
+        elif counter['name'] in ('quiz_circuit_rejected_total', 'quiz_gpt_degraded_total'):
+            key = counter['name']
+        else:
+            continue
+        totals[key] = totals.get(key, 0) + counter['value']
+    return totals
+
+
+def start_outage(openai_fake, args):
+    """フェイクOpenAIに障害を注入"""
+    if args.outage == 'slow':
+        openai_fake.latency.mean = args.gpt_timeout * 3
+    elif args.outage == 'slow_healthy':
+        openai_fake.latency.mean = args.openai_latency * SLOW_HEALTHY_FACTOR
+    else:
+        openai_fake.failure_rate = 1.0
+
+
+def end_outage(openai_fake, args):
+    """フェイクOpenAIを正常に戻す"""
+    openai_fake.latency.mean = args.openai_latency
+    openai_fake.failure_rate = 0.0
+
+
+def run_outage_test(args):
+    # ブレーカーの設定はutils.gptの読み込み前に環境変数で渡す
+    if args.outage == 'slow_healthy':
+        # タイムアウトと遅い呼び出しの基準はプロファイルの想定応答時間から決めさせる
+        os.environ.pop('QUIZ_GPT_TIMEOUT', None)
+        os.environ.pop('QUIZ_GPT_SLOW_CALL_SECONDS', None)
+    else:
+        os.environ['QUIZ_GPT_TIMEOUT'] = str(args.gpt_timeout)
+        os.environ['QUIZ_GPT_SLOW_CALL_SECONDS'] = str(args.gpt_timeout / 2)
+    os.environ['QUIZ_GPT_BREAKER_OPEN_SECONDS'] = str(args.open_seconds)
+    openai_fake, sheets_fake = setup_environment(args)
+
+    import components.quiz as quiz
+    from utils.gpt import EVALUATION_PROFILES
+    from utils.session_store import SessionStore
+
+    if args.outage == 'slow_healthy':
+        # 試験を短時間で終えるため、正常時の遅延を想定応答時間として時間軸を縮める
+        mock.patch.dict(EVALUATION_PROFILES[args.profile], expected_seconds=args.openai_latency).start()
+
+    # 完全一致の評価キャッシュは使わず、全ての回答でGPT呼び出しまたは縮退モードを通す
+    # （縮退モードが解説を探す同じ問題の評価済みの解説は残る）
+    mock.patch.object(SessionStore, 'get_evaluation', return_value=None).start()
+
+    phases = {}
+    session_index = 0
+
+    def run_phase(name, sessions):
+        nonlocal session_index
+        recorder = Recorder()
+        openai_fake.calls.reset()
+        start = time.perf_counter()
+        for _ in range(sessions):
+            run_session(f"outage{session_index}", recorder, quiz.MAX_QUESTIONS, answer_offset=session_index)
+            session_index += 1
+
+        from utils.gpt import gpt_breaker
+        phases[name] = {
+            'elapsed_seconds': time.perf_counter() - start,
+            # 回答の確定から評価結果が表示されるまでの時間
+            'answer': summarize([
+                submit + wait for submit, wait
+                in zip(recorder.timings.get('answer', []), recorder.timings.get('answer_wait', []))
+            ]),
+            'openai_calls': openai_fake.calls.snapshot(),
+            'breaker_state': gpt_breaker.state,
+            'breaker': breaker_counters(),
+        }
+
+    clear_state_store()
+    run_phase('healthy', args.sessions)
+
+    start_outage(openai_fake, args)
+    run_phase('outage_detect', 1)
+    run_phase('outage', args.sessions)
+
+    end_outage(openai_fake, args)
+    # OPENの待機時間が経過するまで待ってから試行呼び出しをさせる
+    time.sleep(args.open_seconds)
+    run_phase('recovery', args.sessions)
+
+    return {
+        'config': {
+            'sessions': args.sessions,
+            'outage': args.outage,
+            'openai_latency': args.openai_latency,
+            'gpt_timeout': args.gpt_timeout,
+            'open_seconds': args.open_seconds,
+        },
+        'phases': phases,
+    }
+
+
+def check_report(report, max_slowdown):
+    """障害中の応答速度と復旧後のブレーカーの状態を確認し、問題点のリストを返す"""
+    problems = []
+    phases = report['phases']
+    if report['config']['outage'] == 'slow_healthy':
+        # 想定の範囲内の遅さではサーキットを開かず、タイムアウトも縮退モードも起こさない
+        for name, phase in phases.items():
+            if phase['breaker_state'] != 'closed':
+                problems.append(f"{name}でサーキットが開きました: {phase['breaker_state']}")
+            if phase['openai_calls'].get('timeout'):
+                problems.append(f"{name}でタイムアウトが発生: {phase['openai_calls']['timeout']}件")
+        degraded = list(phases.values())[-1]['breaker'].get('quiz_gpt_degraded_total', 0)
+        if degraded:
+            problems.append(f"縮退モードで評価された回答があります: {degraded:.0f}件")
+        return problems
+    healthy = phases['healthy']['answer']['p95']
+    outage = phases['outage']['answer']['p95']
+    # 正常時の遅延が小さい場合の揺れを許容するため50msの余裕を持たせる
+    if outage > healthy * (1 + max_slowdown) + 0.05:
+        problems.append(f"障害中の回答p95が悪化: {healthy * 1000:.1f}ms -> {outage * 1000:.1f}ms")
+    if phases['outage']['breaker_state'] != 'open':
+        problems.append(f"障害中にサーキットが開いていません: {phases['outage']['breaker_state']}")
+    if phases['recovery']['breaker_state'] != 'closed':
+        problems.append(f"復旧後にサーキットが閉じていません: {phases['recovery']['breaker_state']}")
+    return problems
+
+
+def print_report(report):
+    print(f"{'phase':<16}{'answers':>9}{'p50(ms)':>11}{'p95(ms)':>11}{'openai':>9}  breaker")
+    for name, phase in report['phases'].items():
+        answer = phase['answer']
+        openai_calls = phase['openai_calls'].get('chat.completions.create', 0)
+        print(f"{name:<16}{answer['count']:>9}{answer['p50'] * 1000:>11.1f}{answer['p95'] * 1000:>11.1f}"
+              f"{openai_calls:>9}  {phase['breaker_state']}")
+    print()
+    print(f"breaker counters: {list(report['phases'].values())[-1]['breaker']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI APIの障害時の挙動を確認する試験")
+    parser.add_argument('--outage', choices=('failures', 'slow', 'slow_healthy'), default='failures',
+                        help="注入する障害（failures: 即座にエラー、slow: タイムアウトまで応答しない、"
+                             "slow_healthy: 想定の範囲内で遅い正常な応答）")
+    parser.add_argument('--sessions', type=int, default=2, help="各フェーズで実行するクイズセッション数")
+    parser.add_argument('--openai-latency', type=float, default=0.2, help="正常時のフェイクOpenAIの平均遅延（秒）")
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help="フェイクSheetsの平均遅延（秒）")
+    parser.add_argument('--gpt-timeout', type=float, default=1.0, help="OpenAI APIのタイムアウト（秒）")
+    parser.add_argument('--open-seconds', type=float, default=2.0, help="サーキットがOPENを維持する秒数")
+    parser.add_argument('--profile', default='classic', help="評価プロファイル（utils/gpt.pyのEVALUATION_PROFILES）")
+    parser.add_argument('--tail-ratio', type=float, default=0.0, help="フェイクの遅延が5倍になる確率")
+    parser.add_argument('--max-slowdown', type=float, default=0.5, help="障害中に許容する回答p95の悪化率")
+    parser.add_argument('--seed', type=int, default=0, help="遅延の乱数シード")
+    parser.add_argument('--output', help="結果をJSONで保存するパス")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_outage_test(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    problems = check_report(report, args.max_slowdown)
+    if problems:
+        print("\n問題が見つかりました:")
+        for line in problems:
+            print(f"  {line}")
+        return 1
+    if args.outage == 'slow_healthy':
+        print("\n想定の範囲内の遅い応答ではサーキットが開きませんでした")
+    else:
+        print("\n障害中も応答速度を維持し、復旧後にサーキットが閉じました")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,32 @@
+import time
 import streamlit as st
 import pandas as pd
 from pathlib import Path
 from utils.logger import setup_logger, get_logs
+from utils.log_parser import parse_log_lines, to_csv_bytes
+from utils.log_archive import LogArchive
+from utils.metrics import registry, render_prometheus
+from utils.session_memory import session_footprints, process_memory, sweep_idle_sessions
+from utils.config import SESSION_IDLE_SECONDS
 from datetime import datetime, timedelta
 
+# 管理画面で読み込む最大ログ行数
+MAX_LOG_ROWS = 200000
+
+# スタイル付きで表示する最大行数（これを超える場合はスタイルなしで表示）
+MAX_STYLED_ROWS = 5000
+
+def highlight_error_level(level):
+    """ERRORレベルのセルを赤色で強調表示"""
+    return 'color: red' if level == 'ERROR' else ''
+
+# 管理画面のログキャッシュの有効期間（秒）
+ADMIN_CACHE_TTL = 300
+
+# 保持するログキャッシュの世代数（更新のたびに新しい世代ができるため、古い世代から破棄する）
+ADMIN_CACHE_MAX_ENTRIES = 2
+
+@st.cache_resource
 def get_admin_logger():
     """管理者用のロガーを取得"""
     SPREADSHEET_ID = st.secrets["spreadsheet_id"]
@@ -12,14 +35,56 @@ def get_admin_logger():
         user_id="admin"  # 管理者用のログとして識別
     )
 
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=ADMIN_CACHE_MAX_ENTRIES, show_spinner="ログを読み込んでいます...")
+def load_admin_logs(spreadsheet_id, data_version):
+    """ログ全体を取得して型付きのDataFrameとしてキャッシュする
+
+    data_versionは「最新の情報に更新」のたびに変わり、キャッシュを無効化する。
+    フィルターはキャッシュ済みのDataFrameに対してメモリ上で適用する。
+    """
+    logs = get_logs(spreadsheet_id=spreadsheet_id, limit=MAX_LOG_ROWS)
+    return parse_log_lines(logs), datetime.now()
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, show_spinner="アーカイブを検索しています...")
+def load_archived_logs(start_date, end_date, manifest_version):
+    """期間内のアーカイブ済みログを読み込む（manifest_versionはアーカイブの更新で変わる）"""
+    return LogArchive().query(start_date, end_date)
+
+def get_cached_logs():
+    """現在のデータバージョンに対応するキャッシュ済みログを返す"""
+    SPREADSHEET_ID = st.secrets["spreadsheet_id"]
+    return load_admin_logs(SPREADSHEET_ID, st.session_state.get('admin_data_version', 0))
+
+def show_refresh_controls():
+    """キャッシュの取得時刻と更新ボタンの表示"""
+    logger = get_admin_logger()
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        try:
+            _, fetched_at = get_cached_logs()
+            st.caption(f"ログ取得時刻: {fetched_at.strftime('%Y-%m-%d %H:%M:%S')}（{ADMIN_CACHE_TTL // 60}分ごとに自動更新）")
+        except Exception as e:
+            # 取得に失敗しても更新ボタンと他のタブは使えるようにする
+            logger.error(f"ログの読み込みに失敗: {str(e)}")
+            st.error(f"ログの読み込みに失敗しました: {str(e)}")
+    with col2:
+        if st.button("🔄 最新の情報に更新", use_container_width=True):
+            # キャッシュはプロセス全体で共有されるため、他の管理者の更新と重ならない値を使う
+            st.session_state.admin_data_version = time.time()
+            st.rerun()
+
 def show_admin_screen():
     """管理者画面のメイン表示"""
     logger = get_admin_logger()
-    logger.info("管理者画面にアクセスしました")
+    # アクセスログはセッションごとに1回だけ記録する
+    if not st.session_state.get('admin_access_logged'):
+        logger.info("管理者画面にアクセスしました")
+        st.session_state.admin_access_logged = True
     
     st.title("管理者画面 📊")
+    show_refresh_controls()
     
-    tab1, tab2 = st.tabs(["📝 ログ閲覧", "📊 統計情報"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📝 ログ閲覧", "📊 統計情報", "⏱ メトリクス", "🧠 セッション"])
 
     with tab1:
         show_log_viewer()
@@ -27,6 +92,12 @@ def show_admin_screen():
     with tab2:
         show_statistics()
 
+    with tab3:
+        show_metrics_panel()
+
+    with tab4:
+        show_session_memory_panel()
+
     if st.button("クイズ画面に戻る"):
         logger.info("管理者画面からクイズ画面に戻ります")
         st.session_state.screen = 'quiz'
@@ -49,38 +120,28 @@ def show_log_viewer():
     
     level = None if level_filter == "すべて" else level_filter
     try:
-        SPREADSHEET_ID = st.secrets["spreadsheet_id"]
-        logs = get_logs(
-            spreadsheet_id=SPREADSHEET_ID,
-            user_id=user_filter if user_filter else None,
-            level=level,
-            limit=1000  # 表示件数制限
-        )
+        df_logs, _ = get_cached_logs()
+
+        # キャッシュ済みのDataFrameをメモリ上でフィルタリング
+        if user_filter:
+            df_logs = df_logs[df_logs['user_id'] == user_filter]
+        if level:
+            df_logs = df_logs[df_logs['level'] == level]
         
-        if logs:
-            # ログデータをDataFrameに変換
-            df_logs = pd.DataFrame(logs, columns=[
-                'created_at', 'user_id', 'level', 'logger_name', 'message', 'extra_data'
-            ])
-            
-            # タイムスタンプを日本時間に変換
-            df_logs['created_at'] = pd.to_datetime(df_logs['created_at'])
-            
-            # ログ表示
-            st.dataframe(
-                df_logs.style.highlight_cells(
-                    subset=['level'],
-                    value=['ERROR'],
-                    color='red'
-                ),
-                height=400
-            )
+        if not df_logs.empty:
+            # ログ表示（大量の行ではスタイル付けを省略）
+            if len(df_logs) <= MAX_STYLED_ROWS:
+                st.dataframe(
+                    df_logs.style.map(highlight_error_level, subset=['level']),
+                    height=400
+                )
+            else:
+                st.dataframe(df_logs, height=400)
             
-            # CSVダウンロード
-            csv = df_logs.to_csv(index=False)
+            # CSVダウンロード（クリックされたときにチャンクごとに生成）
             st.download_button(
                 label="📥 ログをCSVでダウンロード",
-                data=csv,
+                data=lambda: to_csv_bytes(df_logs),
                 file_name=f"quiz_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                 mime="text/csv"
             )
@@ -91,6 +152,48 @@ def show_log_viewer():
         logger.error(f"ログの読み込みに失敗: {str(e)}")
         st.error(f"ログの読み込みに失敗しました: {str(e)}")
 
+    show_archive_viewer(user_filter, level)
+
+def show_archive_viewer(user_filter, level):
+    """保持期間を過ぎてシートから移動したログの検索"""
+    logger = get_admin_logger()
+    with st.expander("📦 アーカイブ済みのログを検索"):
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input(
+                "開始日",
+                datetime.now().date() - timedelta(days=60),
+                key='archive_start_date'
+            )
+        with col2:
+            end_date = st.date_input("終了日", datetime.now().date(), key='archive_end_date')
+
+        # アーカイブの読み込みは重いため、検索するときだけ行う
+        if not st.toggle("検索する", key='archive_search'):
+            return
+
+        try:
+            df_archived = load_archived_logs(start_date, end_date, LogArchive().manifest_version())
+            if user_filter:
+                df_archived = df_archived[df_archived['user_id'] == user_filter]
+            if level:
+                df_archived = df_archived[df_archived['level'] == level]
+
+            if df_archived.empty:
+                st.info("該当するアーカイブ済みのログがありません")
+                return
+
+            st.dataframe(df_archived, height=400)
+            st.download_button(
+                label="📥 アーカイブをCSVでダウンロード",
+                data=lambda: to_csv_bytes(df_archived),
+                file_name=f"quiz_logs_archive_{start_date:%Y%m%d}_{end_date:%Y%m%d}.csv",
+                mime="text/csv"
+            )
+        except Exception as e:
+            logger.error(f"アーカイブの検索に失敗: {str(e)}")
+            st.error(f"アーカイブの検索に失敗しました: {str(e)}")
+
 def show_statistics():
     """統計情報画面の表示"""
     logger = get_admin_logger()
@@ -107,31 +210,21 @@ def show_statistics():
         end_date = st.date_input("終了日", datetime.now().date())
     
     try:
-        SPREADSHEET_ID = st.secrets["spreadsheet_id"]
-        logs = get_logs(
-            spreadsheet_id=SPREADSHEET_ID,
-            limit=1000
-        )
+        df_logs, _ = get_cached_logs()
         
-        if logs:
-            # ログデータをDataFrameに変換
-            df_logs = pd.DataFrame(logs, columns=[
-                'created_at', 'user_id', 'level', 'logger_name', 'message', 'extra_data'
-            ])
-            
-            # タイムスタンプを変換
-            df_logs['created_at'] = pd.to_datetime(df_logs['created_at'])
-            
+        if not df_logs.empty:
             # 期間でフィルタリング
             mask = (df_logs['created_at'].dt.date >= start_date) & (df_logs['created_at'].dt.date <= end_date)
             df_filtered = df_logs[mask]
             
-            # クイズ関連のログのみを抽出
-            df_quiz = df_filtered[df_filtered['message'].str.contains('正解|不正解', na=False)]
+            # クイズ関連のログのみを抽出（「不正解」が「正解」に一致しないよう区切りまで含めて判定）
+            is_correct = df_filtered['message'].str.contains(' - 正解 - ', regex=False, na=False)
+            is_incorrect = df_filtered['message'].str.contains(' - 不正解 - ', regex=False, na=False)
+            df_quiz = df_filtered[is_correct | is_incorrect]
             
             # 基本統計の計算
             total_answers = len(df_quiz)
-            correct_answers = len(df_quiz[df_quiz['message'].str.contains('正解', na=False)])
+            correct_answers = int(is_correct.sum())
             accuracy = (correct_answers / total_answers * 100) if total_answers > 0 else 0
             
             # 統計情報の表示
@@ -150,10 +243,131 @@ def show_statistics():
             }).rename(columns={'message': '回答数'})
             st.dataframe(user_stats)
             
-            logger.info(f"統計情報を表示しました（期間：{start_date}～{end_date}）")
+            # 期間が変わったときだけ記録する
+            period = (start_date, end_date)
+            if st.session_state.get('admin_logged_period') != period:
+                logger.info(f"統計情報を表示しました（期間：{start_date}～{end_date}）")
+                st.session_state.admin_logged_period = period
         else:
             st.info("表示するデータがありません")
             
     except Exception as e:
         logger.error(f"統計情報の集計に失敗: {str(e)}")
-        st.error(f"統計情報の集計に失敗しました: {str(e)}")
\ No newline at end of file
+        st.error(f"統計情報の集計に失敗しました: {str(e)}")
+
+def show_log_routing_summary(counters):
+    """Google Sheetsへのログ送信件数と、間引き・レート制限で送らなかった件数の表示"""
+    summary = {}
+    for c in counters:
+        if c['name'] == 'quiz_log_sent_total':
+            column = '送信'
+        elif c['name'] == 'quiz_log_dropped_total':
+            column = '間引き' if c['labels'].get('reason') == 'sampled' else 'レート制限'
+        else:
+            continue
+        route = c['labels'].get('route', '')
+        row = summary.setdefault(route, {'ルール': route, '送信': 0, '間引き': 0, 'レート制限': 0})
+        row[column] += c['value']
+
+    if summary:
+        st.subheader("ログの送信状況")
+        st.dataframe(pd.DataFrame(list(summary.values())), hide_index=True)
+
+def show_metrics_panel():
+    """このプロセスで計測した処理時間と回数の表示"""
+    st.header("メトリクス")
+    st.caption("このサーバープロセスの起動以降に計測した値です（ワーカーごとに集計）")
+
+    counters, histograms = registry.snapshot()
+    if not counters and not histograms:
+        st.info("まだ計測データがありません")
+        return
+
+    if histograms:
+        st.subheader("処理時間")
+        df_spans = pd.DataFrame([
+            {
+                'スパン': ', '.join(f"{k}={v}" for k, v in h['labels'].items()),
+                '回数': h['count'],
+                '平均(ms)': h['sum'] / h['count'] * 1000 if h['count'] else 0.0,
+                'p50(ms)': h['p50'] * 1000,
+                'p95(ms)': h['p95'] * 1000,
+                'p99(ms)': h['p99'] * 1000,
+                '合計(秒)': h['sum'],
+            }
+            for h in histograms
+        ]).sort_values('合計(秒)', ascending=False)
+        st.dataframe(df_spans, hide_index=True)
+
+    if counters:
+        st.subheader("カウンタ")
+        df_counters = pd.DataFrame([
+            {
+                '名前': c['name'],
+                'ラベル': ', '.join(f"{k}={v}" for k, v in c['labels'].items()),
+                '値': c['value'],
+            }
+            for c in counters
+        ])
+        st.dataframe(df_counters, hide_index=True)
+
+    show_log_routing_summary(counters)
+
+    prometheus_text = render_prometheus()
+    with st.expander("Prometheus形式で表示"):
+        st.code(prometheus_text, language='text')
+    st.download_button(
+        label="📥 メトリクスをダウンロード",
+        data=prometheus_text,
+        file_name=f"quiz_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prom",
+        mime="text/plain"
+    )
+
+def format_bytes(size):
+    """バイト数をKB・MBで表示"""
+    if size is None:
+        return "-"
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f} MB"
+    return f"{size / 1024:.1f} KB"
+
+def show_session_memory_panel():
+    """このプロセスのセッションごとのメモリ使用量と、アイドルセッションの退避"""
+    logger = get_admin_logger()
+    st.header("セッション")
+    st.caption(
+        f"このサーバープロセスのセッション状態のおおよその使用量です。"
+        f"{SESSION_IDLE_SECONDS / 60:.0f}分間操作がないセッションの回答履歴は進捗の保存先に退避されます"
+    )
+
+    if st.button("🧹 アイドルセッションを今すぐ退避"):
+        evicted = sweep_idle_sessions()
+        logger.info(f"アイドルセッションを退避しました（{evicted}件）")
+        st.success(f"{evicted}件のセッションの履歴を退避しました")
+
+    footprints = session_footprints()
+    memory = process_memory()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric(label="セッション数", value=len(footprints))
+    with col2:
+        st.metric(label="セッション状態の合計", value=format_bytes(sum(f['total_bytes'] for f in footprints)))
+    with col3:
+        st.metric(label="プロセスのメモリ(RSS)", value=format_bytes(memory['rss']))
+    if memory['traced'] is not None:
+        st.caption(f"tracemallocで追跡中の確保量: {format_bytes(memory['traced'])}")
+
+    if footprints:
+        df_sessions = pd.DataFrame([
+            {
+                'ID': f['nickname'] or '（未ログイン）',
+                '画面': f['screen'],
+                '最終操作(分前)': round(f['idle_seconds'] / 60, 1) if f['idle_seconds'] is not None else None,
+                '退避済み': f['evicted'],
+                '合計(KB)': f['total_bytes'] / 1024,
+                '問題データ(KB)': f['sizes'].get('quiz_df', 0) / 1024,
+                '回答履歴(KB)': (f['sizes'].get('answers_history', 0) + f['sizes'].get('quiz_results', 0)) / 1024,
+            }
+            for f in footprints
+        ])
+        st.dataframe(df_sessions, hide_index=True)
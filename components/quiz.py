@@ -1,12 +1,18 @@
+import time
 import streamlit as st
 import streamlit.components.v1 as components
-from utils.gpt import evaluate_answer_with_gpt
+from utils.gpt import evaluate_answers_batch_with_gpt
 from utils.logger import setup_logger
-import asyncio
+from utils.session_store import save_progress
+from utils.leaderboard import record_quiz_result
+from utils.evaluation_jobs import get_job_registry, evaluation_job_key
 
 # 問題数の制限を定数として定義
 MAX_QUESTIONS = 15
 
+# 評価ジョブの完了を確認する間隔（秒）
+EVALUATION_POLL_SECONDS = 0.5
+
 def show_quiz_screen(df, logger=None):
     """クイズ画面を表示する関数"""
     if logger is None:
@@ -23,16 +29,28 @@ def show_quiz_screen(df, logger=None):
         st.session_state.answers_history = {}
     if 'total_attempted' not in st.session_state:
         st.session_state.total_attempted = 0
+    if 'exam_answers' not in st.session_state:
+        st.session_state.exam_answers = {}
+    if st.session_state.get('quiz_started_at') is None:
+        st.session_state.quiz_started_at = time.time()
 
     # 終了条件のチェック（total_attemptedベース）
     if st.session_state.total_attempted >= MAX_QUESTIONS:
+        # 試験モードでは未採点の回答をここでまとめて採点する
+        if st.session_state.exam_answers and not grade_exam_answers(logger):
+            return
         logger.info(f"ユーザー[{st.session_state.nickname}] - {MAX_QUESTIONS}問完了")
+        correct_count = sum(1 for v in st.session_state.correct_answers.values() if v)
+        elapsed_seconds = time.time() - st.session_state.quiz_started_at
         st.session_state.quiz_results = {
             'total_questions': MAX_QUESTIONS,
-            'correct_count': sum(1 for v in st.session_state.correct_answers.values() if v),
+            'correct_count': correct_count,
+            'elapsed_seconds': elapsed_seconds,
             'answers_history': st.session_state.answers_history
         }
+        record_quiz_result(st.session_state.nickname, correct_count, elapsed_seconds)
         st.session_state.screen = 'result'
+        save_progress()
         st.rerun()
         return
 
@@ -58,34 +76,90 @@ def show_quiz_screen(df, logger=None):
 
     st.markdown(f'## {question}')
 
-    select_button = st.radio('回答を選択してください', options, index=None, horizontal=True)
+    pending = st.session_state.get('pending_evaluation')
+    if pending is not None and pending['question_index'] == current_question:
+        # 評価中は回答を変更できないようにする
+        st.radio(
+            '回答を選択してください',
+            options,
+            index=options.index(pending['user_answer']) if pending['user_answer'] in options else None,
+            horizontal=True,
+            disabled=True
+        )
+        collect_answer(pending, logger)
+    else:
+        select_button = st.radio('回答を選択してください', options, index=None, horizontal=True)
 
-    if st.button('回答を確定する'):
-        if select_button is None:
-            st.warning('回答を選択してください。')
-            return
-        
-        handle_answer(select_button, question, options, current_question, logger)
+        if st.button('回答を確定する'):
+            if select_button is None:
+                st.warning('回答を選択してください。')
+                return
+
+            if st.session_state.get('exam_mode'):
+                record_exam_answer(select_button, question, options, current_question, logger, s_selected.get('回答'))
+            else:
+                handle_answer(select_button, question, options, current_question, logger, s_selected.get('回答'))
+
+    show_navigation_buttons(df, current_question, logger)
+
+def handle_answer(select_button, question, options, current_question, logger, correct_answer=None):
+    """回答ハンドリング処理（評価はバックグラウンドのジョブで実行する）"""
+    if current_question in st.session_state.answered_questions:
+        return
+
+    pending = {
+        'question_index': current_question,
+        'question': question,
+        'options': options,
+        'user_answer': select_button,
+        'correct_answer': correct_answer,
+    }
+    st.session_state.pending_evaluation = pending
+    get_job_registry().submit_evaluation(
+        st.session_state.nickname, current_question, question, options, select_button, correct_answer
+    )
+    save_progress()
+
+    # 評価キャッシュにあればこの実行で結果を表示する
+    collect_answer(pending, logger)
+
+def collect_answer(pending, logger):
+    """評価ジョブが完了していれば結果を受け取って表示し、実行中なら完了を待つ表示をする"""
+    registry = get_job_registry()
+    key = evaluation_job_key(st.session_state.nickname, pending['question_index'], pending['user_answer'])
+    future = registry.get(key)
+    if future is None:
+        # サーバーの再起動などでジョブが失われた場合は再投入する（評価済みならキャッシュから返る）
+        future = registry.submit_evaluation(
+            st.session_state.nickname,
+            pending['question_index'],
+            pending['question'],
+            pending['options'],
+            pending['user_answer'],
+            pending['correct_answer'],
+        )
 
-    show_navigation_buttons(current_question, logger)
+    if not future.done():
+        show_evaluation_progress(key, 'AIが回答を評価しています...')
+        return
 
-async def evaluate_answer_with_gpt_wrapper(question, options, user_answer):
-    """GPT評価の呼び出しをラップする関数"""
-    return await evaluate_answer_with_gpt(
-        question=question,
-        options=options,
-        user_answer=user_answer
+    gpt_response = future.result()
+    registry.discard(key)
+    st.session_state.pending_evaluation = None
+    show_evaluation_result(
+        pending['user_answer'], pending['question'], pending['question_index'], gpt_response, logger
     )
 
-def handle_answer(select_button, question, options, current_question, logger):
-    """回答ハンドリング処理"""
-    with st.spinner('GPT-4が回答を評価しています...'):
-        gpt_response = asyncio.run(evaluate_answer_with_gpt_wrapper(
-            question,
-            options,
-            select_button
-        ))
-    
+@st.fragment(run_every=EVALUATION_POLL_SECONDS)
+def show_evaluation_progress(key, message):
+    """評価ジョブの完了を待つ間の表示（完了したら画面全体を再実行して結果を表示する）"""
+    future = get_job_registry().get(key)
+    if future is None or future.done():
+        st.rerun()
+    st.info(message, icon="⏳")
+
+def show_evaluation_result(select_button, question, current_question, gpt_response, logger):
+    """評価結果の保存と表示"""
     is_correct = "RESULT:[CORRECT]" in gpt_response
     
     # 回答結果の保存
@@ -97,15 +171,69 @@ def handle_answer(select_button, question, options, current_question, logger):
         'explanation': gpt_response,
     }
     
-    # ログにキャラクター情報を追加
-    if is_correct:
-        logger.info(f"ユーザー[{st.session_state.nickname}] - 正解 - 問題番号: {st.session_state.total_attempted + 1}, ユーザー回答: {select_button}")
-    else:
-        logger.info(f"ユーザー[{st.session_state.nickname}] - 不正解 - 問題番号: {st.session_state.total_attempted + 1}, ユーザー回答: {select_button}")
-    
+    # 回答のログはprocess_answerで一度だけ記録する
     show_answer_animation(is_correct)
     process_answer(is_correct, current_question, select_button, gpt_response, logger)
 
+def record_exam_answer(select_button, question, options, current_question, logger, correct_answer=None):
+    """試験モードの回答記録処理（採点は全問回答後にまとめて行う）"""
+    if current_question in st.session_state.answered_questions:
+        return
+
+    st.session_state.exam_answers[current_question] = {
+        'question': question,
+        'options': options,
+        'user_answer': select_button,
+        'correct_answer': correct_answer,
+    }
+    st.session_state.answers_history[current_question] = {
+        'question': question,
+        'user_answer': select_button,
+        'is_correct': None,
+        'explanation': '',
+    }
+
+    logger.info(f"ユーザー[{st.session_state.nickname}] - 回答記録 - 問題番号: {st.session_state.total_attempted + 1}, ユーザー回答: {select_button}")
+
+    st.session_state.total_attempted += 1
+    st.session_state.answered_questions.add(current_question)
+    save_progress()
+
+    st.info("📝 回答を記録しました。採点は全問回答後にまとめて行います。")
+
+def grade_exam_answers(logger):
+    """試験モードで記録した回答をまとめて採点し、結果をセッションに反映する
+
+    採点はバックグラウンドのジョブで行い、完了していればTrueを返す。
+    """
+    question_ids = sorted(st.session_state.exam_answers)
+    items = [st.session_state.exam_answers[q] for q in question_ids]
+
+    registry = get_job_registry()
+    key = ('exam', st.session_state.nickname, tuple((q, item['user_answer']) for q, item in zip(question_ids, items)))
+    future = registry.submit(key, evaluate_answers_batch_with_gpt, items, log_user=st.session_state.nickname)
+    if not future.done():
+        show_evaluation_progress(key, '全ての回答をまとめて採点しています...')
+        return False
+
+    responses = future.result()
+    registry.discard(key)
+
+    for number, (current_question, item, gpt_response) in enumerate(zip(question_ids, items, responses), start=1):
+        is_correct = "RESULT:[CORRECT]" in gpt_response
+        st.session_state.correct_answers[current_question] = is_correct
+        st.session_state.answers_history[current_question] = {
+            'question': item['question'],
+            'user_answer': item['user_answer'],
+            'is_correct': is_correct,
+            'explanation': gpt_response,
+        }
+        logger.info(f"ユーザー[{st.session_state.nickname}] - {'正解' if is_correct else '不正解'} - 問題番号: {number}, ユーザー回答: {item['user_answer']}")
+
+    st.session_state.exam_answers = {}
+    save_progress()
+    return True
+
 def show_answer_animation(is_correct):
     """正解・不正解のアニメーション表示"""
     if is_correct:
@@ -212,6 +340,7 @@ def process_answer(is_correct, current_question, select_button, gpt_response, lo
         
         st.session_state.total_attempted += 1
         st.session_state.answered_questions.add(current_question)
+        save_progress()
     
     try:
         # GPTレスポンスから情報を抽出
@@ -325,7 +454,7 @@ def process_answer(is_correct, current_question, select_button, gpt_response, lo
         # エラーの詳細をログに記録
         logger.error(f"エラーの詳細: {str(e)}", exc_info=True)
     
-def show_navigation_buttons(current_question, logger):
+def show_navigation_buttons(df, current_question, logger):
     """ナビゲーションボタンの表示"""
     # 解説との間にスペースを追加
     st.markdown("<div style='margin-top: 40px;'></div>", unsafe_allow_html=True)
@@ -351,6 +480,7 @@ def show_navigation_buttons(current_question, logger):
                 while next_question in st.session_state.answered_questions:
                     next_question = (next_question + 1) % len(df)
                 st.session_state.question_index = next_question
+                save_progress()
                 st.rerun()
     
     # フッターのような余白を追加
@@ -1,15 +1,26 @@
 import streamlit as st
+import pandas as pd
 from utils.logger import logger
+from utils.session_store import clear_progress, reset_quiz_state
+from utils.leaderboard import get_leaderboard
+
+# ランキングに表示する上位の人数
+LEADERBOARD_SIZE = 10
+
+def format_seconds(seconds):
+    """所要時間を「分:秒」で表示"""
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
 
 def show_result_screen(df):
     st.title("🙌クイズ完了")
     
     # quiz_resultsからスコア情報を取得
-    if 'quiz_results' not in st.session_state:
+    results = st.session_state.get('quiz_results')
+    if not results:
         logger.error("quiz_resultsが見つかりません")
         return
         
-    results = st.session_state.quiz_results
     total_questions = results['total_questions']  # MAX_QUESTIONS(3)と同じ
     correct_count = results['correct_count']
     
@@ -42,26 +53,48 @@ def show_result_screen(df):
         st.markdown("### 👍 よく頑張りました！")
     else:
         st.markdown("### 💪 次は更に良い成績を目指しましょう！")
+
+    show_leaderboard()
     
     # リトライボタン
     if st.button("もう一度チャレンジ"):
         reset_session_state()
         st.rerun()
 
+def show_leaderboard():
+    """上位のランキングと自分の順位の表示"""
+    st.markdown("## 🏆 ランキング")
+    try:
+        leaderboard = get_leaderboard()
+        top = leaderboard.top(LEADERBOARD_SIZE)
+        own = leaderboard.rank_of(st.session_state.get('nickname'))
+    except Exception as e:
+        logger.error(f"ランキングの取得に失敗: {str(e)}")
+        st.info("ランキングを表示できません")
+        return
+
+    if own:
+        st.markdown(
+            f"### あなたの順位: {own['rank']}位 / {own['players']}人中"
+            f"（最高 {own['score']}問正解・{format_seconds(own['seconds'])}）"
+        )
+    if top:
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    '順位': row['rank'],
+                    'ID': row['nickname'],
+                    '正解数': row['score'],
+                    'タイム': format_seconds(row['seconds']),
+                }
+                for row in top
+            ]),
+            hide_index=True
+        )
+
 def reset_session_state():
     """クイズの状態を初期化"""
     logger.info("クイズを再スタート")
+    clear_progress()
     
-    # 初期化が必要な全てのセッション状態をリセット
-    keys_to_reset = {
-        'screen': 'quiz',
-        'question_index': 0,
-        'total_attempted': 0,
-        'answered_questions': set(),
-        'correct_answers': {},
-        'answers_history': {},
-        'quiz_results': None
-    }
-    
-    for key, value in keys_to_reset.items():
-        st.session_state[key] = value
\ No newline at end of file
+    reset_quiz_state()
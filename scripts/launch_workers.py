@@ -0,0 +1,85 @@
+"""複数のStreamlitワーカーを起動するランチャー
+
+全ワーカーは同じ共有ストア（SQLite）を使うため、GPT評価キャッシュ・
+セッションの進捗・ログキューがワーカー間で共有される。
+ロードバランサーはWebSocketを使うためスティッキーセッションで構成すること。
+
+使い方:
+    python scripts/launch_workers.py --workers 4 --base-port 8501
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streamlitワーカーを複数起動します")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="起動するワーカー数（デフォルト: CPUコア数）")
+    parser.add_argument("--base-port", type=int, default=8501,
+                        help="最初のワーカーのポート番号（以降は連番）")
+    parser.add_argument("--state-db", default=os.path.join(ROOT_DIR, "data", "quiz_state.db"),
+                        help="全ワーカーで共有するSQLiteファイルのパス")
+    parser.add_argument("--address", default="0.0.0.0", help="待ち受けアドレス")
+    parser.add_argument("--metrics-base-port", type=int, default=0,
+                        help="各ワーカーの/metricsのポート番号の開始値（0で無効。METRICS_PORTのシークレットより優先）")
+    return parser.parse_args()
+
+
+def start_worker(port, args):
+    """1つのワーカープロセスを起動"""
+    env = dict(os.environ)
+    env["QUIZ_SHARED_STATE"] = "1"
+    env["QUIZ_STATE_DB"] = os.path.abspath(args.state_db)
+    # 全ワーカーがMETRICS_PORTのシークレットの同じポートを取り合わないよう、
+    # ポートはワーカーごとに割り当てるか、指定がなければ無効にする
+    if args.metrics_base_port:
+        env["QUIZ_METRICS_PORT"] = str(args.metrics_base_port + port - args.base_port)
+    else:
+        env["QUIZ_METRICS_PORT"] = "0"
+    command = [
+        sys.executable, "-m", "streamlit", "run", "streamlit_app.py",
+        "--server.port", str(port),
+        "--server.address", args.address,
+        "--server.headless", "true",
+    ]
+    return subprocess.Popen(command, cwd=ROOT_DIR, env=env)
+
+
+def main():
+    args = parse_args()
+    os.makedirs(os.path.dirname(os.path.abspath(args.state_db)), exist_ok=True)
+
+    workers = {}
+    for i in range(args.workers):
+        port = args.base_port + i
+        workers[port] = start_worker(port, args)
+        print(f"ワーカーを起動しました - ポート: {port}, PID: {workers[port].pid}")
+
+    def shutdown(signum, frame):
+        print("ワーカーを停止しています...")
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.wait()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    # 異常終了したワーカーは再起動する
+    while True:
+        for port, process in list(workers.items()):
+            if process.poll() is not None:
+                print(f"ワーカーが終了しました（ポート: {port}, 終了コード: {process.returncode}）。再起動します")
+                workers[port] = start_worker(port, args)
+        time.sleep(2)
+
+
+if __name__ == "__main__":
+    main()
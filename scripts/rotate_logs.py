@@ -0,0 +1,91 @@
+"""ログシートの保持期間を過ぎた行をアーカイブに移すジョブ
+
+cronなどで定期的に実行し、ライブのログシートを小さく保つ。
+アーカイブは日付ごとのgzip圧縮JSONLで、manifest.jsonから期間を指定して検索できる。
+
+使い方:
+    python scripts/rotate_logs.py --max-age-days 30
+    python scripts/rotate_logs.py --dry-run
+    python scripts/rotate_logs.py --query 2024-10-01 2024-10-31 --user user1 --output october.csv
+"""
+import os
+import sys
+import uuid
+import argparse
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+LEASE_NAME = 'log_retention'
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_args():
+    from utils.config import LOG_RETENTION_DAYS, LOG_ARCHIVE_DIR
+
+    parser = argparse.ArgumentParser(description="保持期間を過ぎたログをアーカイブに移します")
+    parser.add_argument("--max-age-days", type=int, default=LOG_RETENTION_DAYS,
+                        help=f"ログシートに残す日数（デフォルト: {LOG_RETENTION_DAYS}）")
+    parser.add_argument("--archive-dir", default=LOG_ARCHIVE_DIR, help="アーカイブの保存先")
+    parser.add_argument("--dry-run", action="store_true", help="対象の行数を表示するだけで変更しない")
+    parser.add_argument("--query", nargs=2, metavar=("START", "END"), type=parse_date,
+                        help="ローテーションせずにアーカイブ済みのログを期間（YYYY-MM-DD）で検索する")
+    parser.add_argument("--user", help="検索するユーザーID")
+    parser.add_argument("--level", help="検索するログレベル")
+    parser.add_argument("--output", help="検索結果を保存するCSVのパス（省略時は標準出力）")
+    return parser.parse_args()
+
+
+def query(args):
+    from utils.log_archive import LogArchive
+    from utils.log_parser import to_csv_bytes
+
+    df = LogArchive(args.archive_dir).query(args.query[0], args.query[1], user_id=args.user, level=args.level)
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(to_csv_bytes(df))
+        print(f"{len(df)}行を保存しました: {args.output}")
+    else:
+        print(df.to_string(index=False))
+
+
+def rotate(args):
+    from utils.log_archive import LogArchive, rotate_logs
+    from utils.session_store import get_session_store
+
+    # 複数のジョブが同時にシートの行を削除しないようにする
+    store = get_session_store()
+    owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    if not store.acquire_lease(LEASE_NAME, owner, ttl=600):
+        print("別のローテーションジョブが実行中です")
+        return 1
+    try:
+        summary = rotate_logs(
+            max_age_days=args.max_age_days,
+            archive=LogArchive(args.archive_dir),
+            dry_run=args.dry_run
+        )
+    finally:
+        store.release_lease(LEASE_NAME, owner)
+
+    prefix = "（ドライラン）" if args.dry_run else ""
+    print(f"{prefix}アーカイブ: {summary['archived']}行, シートから削除: {summary['deleted']}行, "
+          f"残り: {summary['remaining']}行")
+    return 0
+
+
+def main():
+    os.chdir(ROOT_DIR)
+    args = parse_args()
+    if args.query:
+        query(args)
+        return 0
+    return rotate(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,14 @@
+import hmac
 import streamlit as st
 import pandas as pd
 from components.quiz import show_quiz_screen
 from components.result import show_result_screen
+from components.admin import show_admin_screen
 from utils.logger import setup_logger
+from utils.session_store import restore_progress, reset_quiz_state
+from utils.session_memory import touch_session, maybe_sweep_idle_sessions
+from utils.metrics import span, inc, start_metrics_server, start_metrics_dump
+from utils.config import METRICS_PORT, METRICS_FILE, METRICS_FILE_INTERVAL, ADMIN_PASSWORD
  
 
 def init_session_state():
@@ -21,6 +27,8 @@ def init_session_state():
         st.session_state.logger = None
     if 'quiz_df' not in st.session_state:
         st.session_state.quiz_df = None
+    if 'exam_mode' not in st.session_state:
+        st.session_state.exam_mode = False
 
 def init_logger():
     """ロガーの初期化と設定"""
@@ -47,7 +55,8 @@ def init_logger():
 def load_data():
     """データの読み込み"""
     try:
-        df = pd.read_excel('kaigai_part15-30.xlsx', sheet_name='sheet1', index_col=0)
+        with span('data.load_excel'):
+            df = pd.read_excel('kaigai_part15-30.xlsx', sheet_name='sheet1', index_col=0)
         return df
     except Exception as e:
         st.error("データの読み込みに失敗しました。")
@@ -64,18 +73,37 @@ def show_sidebar():
                 st.session_state.logger = None
                 st.session_state.screen = 'login'
                 st.session_state.quiz_df = None
+                st.session_state.admin_authenticated = False
                 st.rerun()
 
+        # 管理者画面への切り替え（ADMIN_PASSWORDが設定されている場合のみ）
+        if ADMIN_PASSWORD and st.session_state.screen != 'admin':
+            with st.expander("管理者"):
+                password = st.text_input("管理者パスワード", type="password")
+                if st.button("管理者画面を開く"):
+                    if hmac.compare_digest(password.encode(), ADMIN_PASSWORD.encode()):
+                        st.session_state.admin_authenticated = True
+                        st.session_state.screen = 'admin'
+                        st.rerun()
+                    else:
+                        st.error("パスワードが違います")
+
 def show_login_screen():
     """ログイン画面の表示"""
     st.title("ログイン")
     with st.form("login_form"):
         nickname = st.text_input("IDを入力してください")
+        exam_mode = st.checkbox("試験モード（解説は全問回答後にまとめて表示）")
         submitted = st.form_submit_button("開始")
         
         if submitted and nickname:
             st.session_state.nickname = nickname
             st.session_state.screen = 'quiz'
+            st.session_state.exam_mode = exam_mode
+
+            # 保存済みの進捗があれば再開し、なければ同じタブの前のユーザーの進捗を引き継がないよう初期化する
+            if not restore_progress(nickname):
+                reset_quiz_state()
             
             if init_logger():
                 st.rerun()
@@ -85,23 +113,37 @@ def show_login_screen():
 def main():
     # 初期化処理
     init_session_state()
+    # 操作がない間に退避された履歴を読み戻し、他のアイドルセッションの履歴を退避する
+    touch_session()
+    maybe_sweep_idle_sessions()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    if METRICS_FILE:
+        start_metrics_dump(METRICS_FILE, METRICS_FILE_INTERVAL)
+    inc('quiz_script_runs_total', screen=st.session_state.screen)
     
     # サイドバーの表示
     show_sidebar()
     
     # 画面の表示を切り替え
-    if st.session_state.screen == 'result':
+    if st.session_state.screen == 'admin' and st.session_state.get('admin_authenticated'):
+        with span('screen.admin'):
+            show_admin_screen()
+    elif st.session_state.screen == 'result':
         if st.session_state.quiz_df is not None:
-            show_result_screen(st.session_state.quiz_df)
+            with span('screen.result'):
+                show_result_screen(st.session_state.quiz_df)
         else:
             df = load_data()
             if df is not None:
                 st.session_state.quiz_df = df
-                show_result_screen(df)
+                with span('screen.result'):
+                    show_result_screen(df)
             else:
                 st.error("問題データを読み込めませんでした。")
     elif st.session_state.nickname is None:
-        show_login_screen()
+        with span('screen.login'):
+            show_login_screen()
     else:
         if not init_logger():
             st.error("ロガーの初期化に失敗しました。")
@@ -110,10 +152,11 @@ def main():
         df = load_data()
         if df is not None:
             st.session_state.quiz_df = df
-            show_quiz_screen(
-                df=df,
-                logger=st.session_state.logger,
-            )
+            with span('screen.quiz'):
+                show_quiz_screen(
+                    df=df,
+                    logger=st.session_state.logger,
+                )
         else:
             st.error("問題データを読み込めませんでした。")
 
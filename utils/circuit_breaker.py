@@ -0,0 +1,166 @@
+import time
+import threading
+from collections import deque
+
+from .metrics import inc
+
+# サーキットブレーカーの状態
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """サーキットが開いているため呼び出しを行わなかったことを示す例外"""
+
+
+class CallPermit:
+    """allow_requestが返す呼び出しの許可（結果の記録時に渡す）
+
+    probeはHALF_OPENでの試行呼び出しか、generationは許可したときの状態の世代を表す。
+    """
+    __slots__ = ('probe', 'generation', 'started_at')
+
+    def __init__(self, probe, generation, started_at):
+        self.probe = probe
+        self.generation = generation
+        self.started_at = started_at
+
+
+class CircuitBreaker:
+    """外部APIの失敗率と遅延を監視するサーキットブレーカー
+
+    直近window_seconds秒（最大window_size件）の呼び出しのうち、失敗または
+    slow_call_seconds秒以上かかった呼び出しの割合がしきい値を超えるとOPENになり、
+    open_seconds秒の間は呼び出しを行わない。その後HALF_OPENで少数の試行呼び出しを
+    許可し、成功すればCLOSEDに戻り、失敗すれば再びOPENになる。
+
+    状態の判定には、許可したときと同じ状態の世代の呼び出しの結果だけを使う
+    （CLOSEDの間に始まりHALF_OPENになってから終わった呼び出しで復旧を判断しない）。
+    結果が記録されない試行呼び出しの枠は、release()またはopen_seconds秒の経過で返される。
+
+    Parameters:
+    -----------
+    name : str
+        メトリクスのラベルに使う名前
+    failure_threshold : float
+        OPENにする失敗率（0〜1）
+    slow_call_seconds : float
+        遅い呼び出しとみなす所要時間（秒）。呼び出しごとにrecord_success/record_failureで上書きできる
+    slow_call_threshold : float
+        OPENにする遅い呼び出しの割合（0〜1）
+    min_calls : int
+        判定に必要な最小の呼び出し数
+    open_seconds : float
+        OPENからHALF_OPENに移るまでの時間（秒）
+    half_open_max_calls : int
+        HALF_OPENで同時に許可する試行呼び出しの数
+    """
+    def __init__(self, name, failure_threshold=0.5, slow_call_seconds=10.0, slow_call_threshold=0.5,
+                 min_calls=5, window_size=20, window_seconds=60.0, open_seconds=30.0,
+                 half_open_max_calls=1, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_threshold = slow_call_threshold
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._calls = deque(maxlen=window_size)  # (時刻, 成功したか, 遅かったか)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._generation = 0
+        self._probes = []  # HALF_OPENで結果を待っている試行呼び出しのCallPermit
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def _transition(self, state):
+        """状態を変更（ロック取得済みで呼び出すこと）"""
+        if state == self._state:
+            return
+        self._state = state
+        self._generation += 1
+        self._probes = []
+        if state == OPEN:
+            self._opened_at = self._clock()
+        if state == CLOSED:
+            self._calls.clear()
+        inc('quiz_circuit_transitions_total', breaker=self.name, state=state)
+
+    def _refresh(self):
+        """OPENの待機時間が経過していればHALF_OPENに移す"""
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+
+    def allow_request(self):
+        """呼び出しを行ってよいか判定し、許可する場合はCallPermitを返す（許可しない場合None）
+
+        HALF_OPENでは試行呼び出しの枠を確保する。
+        """
+        with self._lock:
+            self._refresh()
+            now = self._clock()
+            if self._state == CLOSED:
+                return CallPermit(False, self._generation, now)
+            if self._state == HALF_OPEN:
+                # 結果が記録されないままopen_seconds秒を過ぎた試行呼び出しの枠は返す
+                self._probes = [p for p in self._probes if now - p.started_at < self.open_seconds]
+                if len(self._probes) < self.half_open_max_calls:
+                    permit = CallPermit(True, self._generation, now)
+                    self._probes.append(permit)
+                    return permit
+        inc('quiz_circuit_rejected_total', breaker=self.name)
+        return None
+
+    def record_success(self, duration, permit=None, slow_call_seconds=None):
+        """成功した呼び出しを記録（slow_call_secondsは呼び出しの種類ごとの遅い呼び出しの基準）"""
+        self._record(True, duration, permit, slow_call_seconds)
+
+    def record_failure(self, duration, permit=None, slow_call_seconds=None):
+        """失敗した呼び出しを記録"""
+        self._record(False, duration, permit, slow_call_seconds)
+
+    def release(self, permit):
+        """結果を記録せずに呼び出しを終えた場合（キャンセルなど）に試行呼び出しの枠を返す"""
+        with self._lock:
+            if permit in self._probes:
+                self._probes.remove(permit)
+
+    def _record(self, succeeded, duration, permit, slow_call_seconds=None):
+        slow = duration >= (slow_call_seconds or self.slow_call_seconds)
+        with self._lock:
+            if permit is not None and permit.generation != self._generation:
+                # 状態が変わる前に始まった呼び出しの結果は使わない
+                return
+            if permit is not None and permit.probe:
+                # 試行呼び出しの結果で復旧したかを判断する
+                self._transition(CLOSED if succeeded and not slow else OPEN)
+                return
+            if self._state != CLOSED:
+                return
+
+            now = self._clock()
+            self._calls.append((now, succeeded, slow))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failure_rate = sum(1 for _, ok, _ in self._calls if not ok) / total
+            slow_rate = sum(1 for _, _, is_slow in self._calls if is_slow) / total
+            if failure_rate >= self.failure_threshold or slow_rate >= self.slow_call_threshold:
+                self._transition(OPEN)
+
+    def reset(self):
+        """状態を初期化（CLOSEDに戻す）"""
+        with self._lock:
+            self._transition(CLOSED)
+            self._calls.clear()
@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 
 # Google Sheets関連の設定
@@ -6,4 +7,41 @@ SPREADSHEET_ID = st.secrets["gsheet"]["spreadsheet_id"]
 # OpenAI関連の設定
 OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
 
-SHEET_NAME = "sheet1"
\ No newline at end of file
+# OpenAI APIの1リクエストあたりのタイムアウト（秒）とサーキットブレーカーの設定
+# タイムアウトと遅い呼び出しとみなす秒数は、0の場合は評価プロファイルの想定応答時間から決める
+GPT_TIMEOUT = float(os.environ.get("QUIZ_GPT_TIMEOUT") or st.secrets.get("GPT_TIMEOUT", 0))
+GPT_SLOW_CALL_SECONDS = float(os.environ.get("QUIZ_GPT_SLOW_CALL_SECONDS") or st.secrets.get("GPT_SLOW_CALL_SECONDS", 0))
+GPT_BREAKER_OPEN_SECONDS = float(os.environ.get("QUIZ_GPT_BREAKER_OPEN_SECONDS") or st.secrets.get("GPT_BREAKER_OPEN_SECONDS", 30))
+
+SHEET_NAME = "sheet1"
+
+# 回答評価のプロファイル（utils/gpt.py の EVALUATION_PROFILES を参照）
+EVALUATION_PROFILE = os.environ.get("QUIZ_EVALUATION_PROFILE") or st.secrets.get("EVALUATION_PROFILE", "classic")
+
+# 共有状態（複数ワーカー構成）関連の設定
+# 環境変数が優先され、ランチャーから全ワーカーに同じ値を渡す
+STATE_DB_PATH = os.environ.get("QUIZ_STATE_DB") or st.secrets.get("STATE_DB_PATH", os.path.join("data", "quiz_state.db"))
+SHARED_STATE = str(os.environ.get("QUIZ_SHARED_STATE", st.secrets.get("SHARED_STATE", False))).lower() in ("1", "true")
+
+# GPT評価をバックグラウンドで実行するスレッド数
+EVALUATION_WORKERS = int(os.environ.get("QUIZ_EVALUATION_WORKERS") or st.secrets.get("EVALUATION_WORKERS", 16))
+
+# Google Sheetsへのログ送信の制限（ユーザーごとの1分あたりの件数と連続送信できる件数）
+LOG_RATE_PER_MINUTE = float(os.environ.get("QUIZ_LOG_RATE_PER_MINUTE") or st.secrets.get("LOG_RATE_PER_MINUTE", 30))
+LOG_BURST = int(os.environ.get("QUIZ_LOG_BURST") or st.secrets.get("LOG_BURST", 20))
+
+# ログの保持期間（日）と、期間を過ぎたログのアーカイブ先
+LOG_RETENTION_DAYS = int(os.environ.get("QUIZ_LOG_RETENTION_DAYS") or st.secrets.get("LOG_RETENTION_DAYS", 30))
+LOG_ARCHIVE_DIR = os.environ.get("QUIZ_LOG_ARCHIVE_DIR") or st.secrets.get("LOG_ARCHIVE_DIR", os.path.join("data", "log_archive"))
+
+# 操作がないセッションの履歴をストアに退避するまでの秒数と、確認する間隔（秒）
+SESSION_IDLE_SECONDS = float(os.environ.get("QUIZ_SESSION_IDLE_SECONDS") or st.secrets.get("SESSION_IDLE_SECONDS", 1800))
+SESSION_SWEEP_SECONDS = float(os.environ.get("QUIZ_SESSION_SWEEP_SECONDS") or st.secrets.get("SESSION_SWEEP_SECONDS", 60))
+
+# メトリクス関連の設定（未設定の場合はHTTPエンドポイント・ファイルへの書き出しを行わない）
+METRICS_PORT = int(os.environ.get("QUIZ_METRICS_PORT") or st.secrets.get("METRICS_PORT", 0))
+METRICS_FILE = os.environ.get("QUIZ_METRICS_FILE") or st.secrets.get("METRICS_FILE", "")
+METRICS_FILE_INTERVAL = float(os.environ.get("QUIZ_METRICS_FILE_INTERVAL") or st.secrets.get("METRICS_FILE_INTERVAL", 15))
+
+# 管理者画面のパスワード（未設定の場合は管理者画面を開けない）
+ADMIN_PASSWORD = str(os.environ.get("QUIZ_ADMIN_PASSWORD") or st.secrets.get("ADMIN_PASSWORD", ""))
@@ -0,0 +1,152 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .config import EVALUATION_WORKERS
+from .metrics import inc
+from .log_routing import log_user_context
+from .session_store import get_session_store
+
+# グローバル変数としてレジストリを定義
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class EvaluationJobRegistry:
+    """GPT評価をバックグラウンドで実行するジョブの管理
+
+    ジョブは(ユーザー, 問題, 回答)などのキーで登録し、同じキーで再投入しても
+    実行中・完了済みのジョブを返す。Streamlitの再実行やボタンの連打があっても
+    評価は一度しか実行されず、スクリプトの実行はネットワーク待ちでブロックしない。
+    さらに評価キャッシュのキーが同じジョブは、別のユーザーのものでも実行を共有する。
+
+    Parameters:
+    -----------
+    max_workers : int
+        評価を同時に実行するスレッド数
+    retention_seconds : float
+        完了後に受け取られないジョブ（離脱したセッション）を保持する秒数
+    """
+    def __init__(self, max_workers=EVALUATION_WORKERS, retention_seconds=600.0):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='EvaluationJob')
+        self._jobs = {}      # ジョブのキー -> (Future, 登録時刻)
+        self._inflight = {}  # 実行を共有するキー -> 実行中のFuture
+        # 完了済みのFutureではadd_done_callbackがその場で呼ばれるため再入可能なロックを使う
+        self._lock = threading.RLock()
+
+    def _prune(self):
+        """受け取られないまま保持期間を過ぎた完了済みジョブを削除（ロック取得済みで呼び出すこと）"""
+        now = time.time()
+        expired = [
+            key for key, (future, submitted_at) in self._jobs.items()
+            if future.done() and now - submitted_at > self.retention_seconds
+        ]
+        for key in expired:
+            del self._jobs[key]
+
+    def submit(self, key, func, *args, dedup_key=None, log_user=None, **kwargs):
+        """コルーチン関数funcの実行をジョブとして登録し、Futureを返す
+
+        Parameters:
+        -----------
+        key : tuple
+            ジョブのキー（登録済みの場合は既存のジョブを返す）
+        dedup_key : str
+            実行中のジョブと実行を共有するためのキー（省略時は共有しない）
+        log_user : str
+            ジョブ内のログのレート制限に使うユーザー
+        """
+        with self._lock:
+            self._prune()
+            if key in self._jobs:
+                return self._jobs[key][0]
+
+            future = self._inflight.get(dedup_key) if dedup_key is not None else None
+            if future is not None:
+                inc('quiz_evaluation_jobs_shared_total')
+            else:
+                inc('quiz_evaluation_jobs_submitted_total')
+                future = self._executor.submit(self._run, func, args, kwargs, log_user)
+                if dedup_key is not None:
+                    self._inflight[dedup_key] = future
+                    future.add_done_callback(lambda _: self._release(dedup_key, future))
+            self._jobs[key] = (future, time.time())
+            return future
+
+    def _release(self, dedup_key, future):
+        with self._lock:
+            if self._inflight.get(dedup_key) is future:
+                del self._inflight[dedup_key]
+
+    @staticmethod
+    def _run(func, args, kwargs, log_user):
+        with log_user_context(log_user):
+            return asyncio.run(func(*args, **kwargs))
+
+    def get(self, key):
+        """登録済みのジョブのFutureを返す（存在しない場合None）"""
+        with self._lock:
+            job = self._jobs.get(key)
+        return job[0] if job else None
+
+    def discard(self, key):
+        """結果を受け取ったジョブを削除"""
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def submit_evaluation(self, nickname, question_index, question, options, user_answer, correct_answer=None, profile=None):
+        """1問分の回答評価を登録する（評価キャッシュにあれば完了済みのFutureを返す）
+
+        profileは評価プロファイル名（省略時は設定値）。キャッシュと重複排除はプロファイルごとに行う。
+        """
+        from .gpt import evaluate_answer_with_gpt, get_evaluation_profile
+
+        key = evaluation_job_key(nickname, question_index, user_answer)
+        existing = self.get(key)
+        if existing is not None:
+            return existing
+
+        profile = get_evaluation_profile(profile)['name']
+        store = get_session_store()
+        try:
+            cached_response = store.get_evaluation(question, options, user_answer, profile)
+        except Exception as e:
+            print(f"評価キャッシュの読み込み中にエラーが発生: {str(e)}")
+            cached_response = None
+        if cached_response is not None:
+            inc('quiz_gpt_cache_hits_total')
+            future = Future()
+            future.set_result(cached_response)
+            with self._lock:
+                self._jobs.setdefault(key, (future, time.time()))
+                return self._jobs[key][0]
+
+        return self.submit(
+            key,
+            evaluate_answer_with_gpt,
+            question=question,
+            options=options,
+            user_answer=user_answer,
+            correct_answer=correct_answer,
+            profile=profile,
+            dedup_key=store.evaluation_key(question, options, user_answer, profile),
+            log_user=nickname,
+        )
+
+
+def evaluation_job_key(nickname, question_index, user_answer):
+    """1問分の回答評価ジョブのキー"""
+    return ('answer', nickname, question_index, user_answer)
+
+
+def get_job_registry():
+    """プロセス全体で共有するジョブレジストリを返す"""
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = EvaluationJobRegistry()
+    return _registry
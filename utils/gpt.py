@@ -1,17 +1,33 @@
 from openai import OpenAI
 from utils.logger import setup_logger
+from utils.session_store import get_session_store
+from utils.metrics import span, inc
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+import re
+import time
 import asyncio
-from .config import SPREADSHEET_ID, OPENAI_API_KEY
+import unicodedata
+from .config import (
+    SPREADSHEET_ID, OPENAI_API_KEY, EVALUATION_PROFILE,
+    GPT_TIMEOUT, GPT_SLOW_CALL_SECONDS, GPT_BREAKER_OPEN_SECONDS,
+)
 
 # OpenAI クライアントの初期化
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 障害時に待ち続けないよう、リトライはせずタイムアウトとサーキットブレーカーで打ち切る
+# （タイムアウトは評価プロファイルに応じてリクエストごとに指定する）
+client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# OpenAI APIの失敗率・遅延を監視し、障害中は縮退モードで評価する
+# （遅い呼び出しの基準はリクエストごとに評価プロファイルから渡す）
+gpt_breaker = CircuitBreaker('openai', open_seconds=GPT_BREAKER_OPEN_SECONDS)
 
 # loggerの初期化
 logger = setup_logger(spreadsheet_id=SPREADSHEET_ID, user_id="gpt")
 
-async def evaluate_answer_with_gpt(question, options, user_answer):
-    """GPTによる回答評価を行い、結果を返す"""
-    prompt = f"""
+SYSTEM_PROMPT = "あなたはとっても面白いツッコミで人気のお笑い芸人です。ユーザーとは砕けた口調で話します。必ず指定された形式で回答してください。"
+
+# 従来の詳細な指示付きプロンプト
+CLASSIC_PROMPT = """
     問題: {question}
     選択肢: {options}
     ユーザーの回答: {user_answer}
@@ -25,33 +41,434 @@ async def evaluate_answer_with_gpt(question, options, user_answer):
     RESULT:[CORRECT] または RESULT:[INCORRECT]
     あなたの回答: [ユーザーの回答]
     正解: [適切な選択肢]
-    解説: [面白い正解の解説（200字）]
+    解説: [面白い正解の解説（{explanation_chars}字）]
+    """
+
+# 判定と解説をまとめて行う短いプロンプト
+COMPACT_PROMPT = """問題: {question}
+選択肢: {options}
+ユーザーの回答: {user_answer}
+最も適切な選択肢を判定し、次の4行だけを出力:
+RESULT:[CORRECT] または RESULT:[INCORRECT]
+あなたの回答: ユーザーの回答
+正解: 適切な選択肢
+解説: 面白い解説（{explanation_chars}字以内）"""
+
+# 正誤判定済みの回答に解説だけを付けるプロンプト
+EXPLANATION_PROMPT = """問題: {question}
+正解: {correct_answer}
+ユーザーの回答: {user_answer}（{verdict}）
+正解の面白い解説を{explanation_chars}字以内の1段落だけで出力してください。"""
+
+# 試験モードで複数の回答をまとめて評価するプロンプト
+EXAM_BATCH_PROMPT = """以下の{count}問について、ユーザーの回答を評価してください。
+
+{items}
+
+各問題について、問題番号の順に次の形式だけを出力:
+### 問題[番号]
+RESULT:[CORRECT] または RESULT:[INCORRECT]
+あなたの回答: ユーザーの回答
+正解: 適切な選択肢
+解説: 面白い解説（{explanation_chars}字以内）"""
+
+# 試験モードで正誤判定済みの回答にまとめて解説を付けるプロンプト
+EXAM_EXPLANATION_BATCH_PROMPT = """以下の{count}問について、正解の面白い解説を作成してください。
+
+{items}
+
+各問題について、問題番号の順に次の形式だけを出力:
+### 問題[番号]
+解説（{explanation_chars}字以内の1段落）"""
+
+# 1回のリクエストでまとめて評価する問題数（15問なら3リクエストを並列実行）
+EXAM_BATCH_SIZE = 5
+
+BATCH_HEADER_PATTERN = re.compile(r'^\s*#+\s*問題\s*\[?(\d+)\]?\s*$', re.MULTILINE)
+
+# 評価プロファイル
+#   grader: 'model'は正誤判定もモデルが行う、'answer_key'は問題データの正解で判定しモデルは解説のみ
+#   max_tokens: 出力トークンの上限（Noneで無制限）
+#   expected_seconds: 正常時の1問あたりの想定応答時間（秒）。タイムアウトと遅い呼び出しの基準に使う
+EVALUATION_PROFILES = {
+    'classic': {
+        'model': 'gpt-4',
+        'grader': 'model',
+        'prompt': CLASSIC_PROMPT,
+        'max_tokens': None,
+        'temperature': 0.4,
+        'explanation_chars': 200,
+        'expected_seconds': 10,
+    },
+    'compact': {
+        'model': 'gpt-4o-mini',
+        'grader': 'model',
+        'prompt': COMPACT_PROMPT,
+        'max_tokens': 300,
+        'temperature': 0.4,
+        'explanation_chars': 120,
+        'expected_seconds': 3,
+    },
+    'answer_key': {
+        'model': 'gpt-4o-mini',
+        'grader': 'answer_key',
+        'prompt': COMPACT_PROMPT,  # 正解を特定できない問題で使用
+        'max_tokens': 250,
+        'temperature': 0.4,
+        'explanation_chars': 120,
+        'expected_seconds': 3,
+    },
+    'answer_key_rich': {
+        'model': 'gpt-4o',
+        'grader': 'answer_key',
+        'prompt': COMPACT_PROMPT,
+        'max_tokens': 400,
+        'temperature': 0.4,
+        'explanation_chars': 200,
+        'expected_seconds': 5,
+    },
+}
+DEFAULT_PROFILE = 'classic'
+
+# 想定応答時間に対する、遅い呼び出しとみなす時間とタイムアウトの倍率
+SLOW_CALL_FACTOR = 3
+TIMEOUT_FACTOR = 6
+
+ANSWER_PREFIX_PATTERN = re.compile(r'^\s*回答\s*[:：]\s*')
+EXPLANATION_PREFIX_PATTERN = re.compile(r'^\s*解説\s*[:：]\s*')
+EXPLANATION_LINE_PATTERN = re.compile(r'^\s*解説\s*[:：]\s*(.+)$', re.MULTILINE)
+OPTION_LETTERS = 'abc'
+
+# 縮退モードの解説（評価済みの解説が見つからない場合に使用）
+DEGRADED_EXPLANATION = "正解は「{correct_answer}」です。"
+DEGRADED_NOTICE = "（※ 現在AIによる評価を利用できないため、問題データの正解で判定しています）"
+
+
+def get_evaluation_profile(name=None):
+    """名前から評価プロファイルを取得（不明な名前はデフォルト）"""
+    name = name or EVALUATION_PROFILE
+    if name not in EVALUATION_PROFILES:
+        logger.warning(f"不明な評価プロファイル: {name}（{DEFAULT_PROFILE}を使用します）")
+        name = DEFAULT_PROFILE
+    return dict(EVALUATION_PROFILES[name], name=name)
+
+
+def call_limits(profile, items=1):
+    """プロファイルの想定応答時間から（タイムアウト, 遅い呼び出しとみなす秒数）を返す
+
+    itemsは1回のリクエストで評価する問題数で、出力が長くなる分だけ想定応答時間を伸ばす。
+    GPT_TIMEOUT・GPT_SLOW_CALL_SECONDSが設定されている場合はその値を使う。
+    """
+    expected = profile['expected_seconds'] * items
+    return GPT_TIMEOUT or expected * TIMEOUT_FACTOR, GPT_SLOW_CALL_SECONDS or expected * SLOW_CALL_FACTOR
+
+
+def resolve_correct_option(answer_text, options):
+    """問題データの「回答」列の文字列から正解の選択肢を特定する（特定できない場合None）
+
+    例: '回答：Ｃ)隠れる' → 選択肢の3番目
+    """
+    if not isinstance(answer_text, str) or not answer_text.strip():
+        return None
+
+    normalized = unicodedata.normalize('NFKC', ANSWER_PREFIX_PATTERN.sub('', answer_text.strip()))
+    letter = normalized[:1].lower()
+    if letter in OPTION_LETTERS and normalized[1:2] in (')', '.', '）', ' '):
+        index = OPTION_LETTERS.index(letter)
+        if index < len(options):
+            return options[index]
+
+    # 記号で特定できない場合は本文で照合
+    for option in options:
+        if unicodedata.normalize('NFKC', option).strip() in normalized:
+            return option
+    return None
+
+
+def format_evaluation(is_correct, user_answer, correct_answer, explanation):
+    """評価結果をモデルの出力と同じ形式に整形"""
+    return (
+        f"RESULT:[{'CORRECT' if is_correct else 'INCORRECT'}]\n"
+        f"あなたの回答: {user_answer}\n"
+        f"正解: {correct_answer}\n"
+        f"解説: {EXPLANATION_PREFIX_PATTERN.sub('', explanation.strip())}"
+    )
+
+
+def degraded_evaluation(question, options, user_answer, correct_answer=None):
+    """OpenAI APIを利用できない場合の評価（判定できない場合None）
+
+    正誤は問題データの「回答」列で判定し、解説は同じ問題で同じ判定になった評価済みの解説を再利用する。
     """
+    correct_option = resolve_correct_option(correct_answer, options)
+    if correct_option is None:
+        return None
+    inc('quiz_gpt_degraded_total')
+    is_correct = user_answer == correct_option
 
+    explanation = None
     try:
-        logger.info(f"GPT評価開始 - 問題: {question}, ユーザー回答: {user_answer}")
-        
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-4",
-            temperature=0.4,
-            messages=[
-                {"role": "system", "content": "あなたはとっても面白いツッコミで人気のお笑い芸人です。ユーザーとは砕けた口調で話します。必ず指定された形式で回答してください。"},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        gpt_response = response.choices[0].message.content
+        cached_response = get_session_store().get_latest_evaluation(question, is_correct, user_answer)
+    except Exception as e:
+        logger.warning(f"評価キャッシュの読み込みに失敗: {str(e)}")
+        cached_response = None
+    if cached_response is not None:
+        match = EXPLANATION_LINE_PATTERN.search(cached_response)
+        if match:
+            explanation = match.group(1).strip()
+    if not explanation:
+        explanation = DEGRADED_EXPLANATION.format(correct_answer=correct_option)
+
+    return format_evaluation(is_correct, user_answer, correct_option, explanation + DEGRADED_NOTICE)
+
+
+def split_batch_response(text):
+    """まとめて評価した出力を問題番号ごとに分割する（{番号: 本文}）"""
+    parts = BATCH_HEADER_PATTERN.split(text or '')
+    return {int(number): body.strip() for number, body in zip(parts[1::2], parts[2::2])}
+
+
+async def request_completion(profile, prompt, items=1):
+    """プロファイルの設定でChat Completionを呼び出し、トークン数と処理時間を記録する
+
+    itemsは1回のリクエストで評価する問題数で、出力トークンの上限とタイムアウトをその分だけ伸ばす。
+    """
+    kwargs = {
+        'model': profile['model'],
+        'temperature': profile['temperature'],
+        'messages': [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+    }
+    if profile['max_tokens']:
+        kwargs['max_tokens'] = profile['max_tokens'] * items
+    timeout, slow_call_seconds = call_limits(profile, items)
+
+    # サーキットが開いている間はスレッドを使わずに即座に失敗させる
+    permit = gpt_breaker.allow_request()
+    if permit is None:
+        raise CircuitOpenError("OpenAI APIのサーキットが開いています")
+
+    labels = {'profile': profile['name'], 'model': profile['model']}
+    inc('quiz_gpt_requests_total', **labels)
+    start = time.perf_counter()
+    succeeded = None
+    try:
+        with span('gpt.request', **labels):
+            response = await asyncio.to_thread(client.chat.completions.create, timeout=timeout, **kwargs)
+        succeeded = True
+    except Exception:
+        succeeded = False
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        if succeeded is None:
+            # CancelledErrorなど結果が分からない中断では試行呼び出しの枠だけを返す
+            gpt_breaker.release(permit)
+        elif succeeded:
+            gpt_breaker.record_success(duration, permit, slow_call_seconds)
+        else:
+            gpt_breaker.record_failure(duration, permit, slow_call_seconds)
+
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        inc('quiz_gpt_prompt_tokens_total', usage.prompt_tokens or 0, **labels)
+        inc('quiz_gpt_completion_tokens_total', usage.completion_tokens or 0, **labels)
+    return response.choices[0].message.content
+
+
+@span('gpt.evaluate')
+async def evaluate_answer_with_gpt(question, options, user_answer, correct_answer=None, profile=None):
+    """GPTによる回答評価を行い、結果を返す
+
+    correct_answerに問題データの「回答」列を渡すと、answer_key系のプロファイルでは
+    正誤をローカルで判定し、モデルには解説の作成だけを依頼する。
+    """
+    profile = get_evaluation_profile(profile)
+
+    # 同じプロファイルで評価済みの組み合わせはキャッシュから返す（再開したセッションでAPIを呼ばない）
+    try:
+        cached_response = get_session_store().get_evaluation(question, options, user_answer, profile['name'])
+    except Exception as e:
+        logger.warning(f"評価キャッシュの読み込みに失敗: {str(e)}")
+        cached_response = None
+    if cached_response is not None:
+        inc('quiz_gpt_cache_hits_total')
+        logger.info(f"GPT評価キャッシュヒット - 問題: {question}, ユーザー回答: {user_answer}")
+        return cached_response
+
+    correct_option = resolve_correct_option(correct_answer, options) if profile['grader'] == 'answer_key' else None
+
+    try:
+        logger.info(f"GPT評価開始 - 問題: {question}, ユーザー回答: {user_answer}, プロファイル: {profile['name']}")
+
+        if correct_option is not None:
+            is_correct = user_answer == correct_option
+            explanation = await request_completion(profile, EXPLANATION_PROMPT.format(
+                question=question,
+                correct_answer=correct_option,
+                user_answer=user_answer,
+                verdict='正解' if is_correct else '不正解',
+                explanation_chars=profile['explanation_chars'],
+            ))
+            gpt_response = format_evaluation(is_correct, user_answer, correct_option, explanation)
+        else:
+            gpt_response = await request_completion(profile, profile['prompt'].format(
+                question=question,
+                options=options,
+                user_answer=user_answer,
+                explanation_chars=profile['explanation_chars'],
+            ))
+
         logger.info(f"GPT評価完了 - 結果: {gpt_response}")
-        
+
+        try:
+            get_session_store().put_evaluation(question, options, user_answer, profile['name'], gpt_response)
+        except Exception as e:
+            logger.warning(f"評価キャッシュの保存に失敗: {str(e)}")
+
         return gpt_response
 
     except Exception as e:
-        error_msg = f"エラーが発生しました: {str(e)}"
-        logger.error(error_msg)
+        if isinstance(e, CircuitOpenError):
+            logger.warning(f"GPT評価を縮退モードで実行 - 問題: {question}, ユーザー回答: {user_answer}")
+        else:
+            error_msg = f"エラーが発生しました: {str(e)}"
+            logger.error(error_msg)
+
+        # 問題データの正解で判定できる場合はエラーにせず縮退モードの評価を返す
+        gpt_response = degraded_evaluation(question, options, user_answer, correct_answer)
+        if gpt_response is not None:
+            return gpt_response
+
         return f"""
         RESULT:[INCORRECT]
         あなたの回答: {user_answer}
         正解: 評価中にエラーが発生しました
         解説: 申し訳ありません。回答の評価中にエラーが発生しました。もう一度お試しください。
-        """
\ No newline at end of file
+        """
+
+
+async def _evaluate_batch(items, profile):
+    """1回のリクエストで複数の回答を評価し、問題ごとの評価結果のリストを返す
+
+    出力から取り出せなかった問題はNoneになる。
+    """
+    correct_options = [
+        resolve_correct_option(item.get('correct_answer'), item['options'])
+        if profile['grader'] == 'answer_key' else None
+        for item in items
+    ]
+
+    if all(option is not None for option in correct_options):
+        # 正誤はローカルで判定し、解説だけをまとめて依頼する
+        verdicts = [item['user_answer'] == option for item, option in zip(items, correct_options)]
+        listing = '\n\n'.join(
+            f"### 問題{i + 1}\n問題: {item['question']}\n正解: {option}\n"
+            f"ユーザーの回答: {item['user_answer']}（{'正解' if verdict else '不正解'}）"
+            for i, (item, option, verdict) in enumerate(zip(items, correct_options, verdicts))
+        )
+        text = await request_completion(profile, EXAM_EXPLANATION_BATCH_PROMPT.format(
+            count=len(items), items=listing, explanation_chars=profile['explanation_chars']
+        ), items=len(items))
+        explanations = split_batch_response(text)
+        return [
+            format_evaluation(verdict, item['user_answer'], option, explanations[i + 1])
+            if explanations.get(i + 1) else None
+            for i, (item, option, verdict) in enumerate(zip(items, correct_options, verdicts))
+        ]
+
+    listing = '\n\n'.join(
+        f"### 問題{i + 1}\n問題: {item['question']}\n選択肢: {item['options']}\n"
+        f"ユーザーの回答: {item['user_answer']}"
+        for i, item in enumerate(items)
+    )
+    text = await request_completion(profile, EXAM_BATCH_PROMPT.format(
+        count=len(items), items=listing, explanation_chars=profile['explanation_chars']
+    ), items=len(items))
+    blocks = split_batch_response(text)
+    return [
+        blocks.get(i + 1) if 'RESULT:[' in blocks.get(i + 1, '') else None
+        for i in range(len(items))
+    ]
+
+
+@span('gpt.evaluate_batch')
+async def evaluate_answers_batch_with_gpt(items, profile=None, batch_size=EXAM_BATCH_SIZE):
+    """試験モード用に複数の回答をまとめて評価する
+
+    Parameters:
+    -----------
+    items : list[dict]
+        question, options, user_answer, correct_answer（任意）を持つ辞書のリスト
+    profile : str
+        評価プロファイル名（省略時は設定値）
+    batch_size : int
+        1回のリクエストで評価する問題数。複数のリクエストは並列に実行する
+
+    Returns:
+    --------
+    list[str]
+        itemsと同じ順序の評価結果（evaluate_answer_with_gptと同じ形式）
+    """
+    profile = get_evaluation_profile(profile)
+    results = [None] * len(items)
+
+    # キャッシュ済みの回答は評価対象から外す
+    pending = []
+    for index, item in enumerate(items):
+        try:
+            cached_response = get_session_store().get_evaluation(
+                item['question'], item['options'], item['user_answer'], profile['name']
+            )
+        except Exception as e:
+            logger.warning(f"評価キャッシュの読み込みに失敗: {str(e)}")
+            cached_response = None
+        if cached_response is not None:
+            inc('quiz_gpt_cache_hits_total')
+            results[index] = cached_response
+        else:
+            pending.append(index)
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    if batches:
+        logger.info(f"GPT一括評価開始 - 問題数: {len(pending)}, リクエスト数: {len(batches)}, プロファイル: {profile['name']}")
+        outcomes = await asyncio.gather(
+            *(_evaluate_batch([items[i] for i in batch], profile) for batch in batches),
+            return_exceptions=True
+        )
+        for batch, outcome in zip(batches, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"GPT一括評価でエラーが発生: {str(outcome)}")
+                continue
+            for index, response in zip(batch, outcome):
+                if response is None:
+                    continue
+                results[index] = response
+                try:
+                    get_session_store().put_evaluation(
+                        items[index]['question'], items[index]['options'], items[index]['user_answer'],
+                        profile['name'], response
+                    )
+                except Exception as e:
+                    logger.warning(f"評価キャッシュの保存に失敗: {str(e)}")
+
+    # 一括評価の出力から取り出せなかった回答は個別に評価する
+    missing = [index for index, response in enumerate(results) if response is None]
+    if missing:
+        logger.warning(f"一括評価の結果が不足しているため個別に評価します - 問題数: {len(missing)}")
+        responses = await asyncio.gather(*(
+            evaluate_answer_with_gpt(
+                question=items[index]['question'],
+                options=items[index]['options'],
+                user_answer=items[index]['user_answer'],
+                correct_answer=items[index].get('correct_answer'),
+                profile=profile['name'],
+            )
+            for index in missing
+        ))
+        for index, response in zip(missing, responses):
+            results[index] = response
+
+    return results
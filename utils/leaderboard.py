@@ -0,0 +1,152 @@
+import time
+
+from .session_store import get_session_store
+
+# 順位の集計に使うバケット（スコア0〜127点 × 所要時間0〜4095秒）
+SCORE_SLOTS = 128
+SECONDS_SLOTS = 4096
+FENWICK_SIZE = SCORE_SLOTS * SECONDS_SLOTS
+
+
+def _bucket(score, seconds):
+    """成績を順位集計用のバケット番号（1始まり、小さいほど上位）に変換"""
+    score = min(max(int(score), 0), SCORE_SLOTS - 1)
+    seconds = min(max(int(seconds), 0), SECONDS_SLOTS - 1)
+    return (SCORE_SLOTS - 1 - score) * SECONDS_SLOTS + seconds + 1
+
+
+def _is_better(score, seconds, best_score, best_seconds):
+    return score > best_score or (score == best_score and seconds < best_seconds)
+
+
+class Leaderboard:
+    """ユーザーごとの最高成績（正解数が多い順、同点なら所要時間が短い順）のランキング
+
+    leaderboardテーブルはカバリングインデックスで成績順に並べており、上位k件は
+    インデックスの先頭から読むだけで取得できる。自分の順位は成績のバケットごとの
+    人数をフェニック木（leaderboard_fenwickテーブル）で持ち、参加者数によらず
+    O(log バケット数)回の主キー検索で求める。所要時間は秒単位で比較し、同じ正解数・
+    同じ秒数のユーザーは同順位とする。
+
+    テーブルはSessionStoreが作成し、同じSQLiteファイルを複数のワーカーから共有する。
+    """
+    def __init__(self, store=None):
+        self.store = store or get_session_store()
+
+    @staticmethod
+    def _fenwick_add(conn, index, delta):
+        """バケットindexの人数にdeltaを加える"""
+        updates = []
+        while index <= FENWICK_SIZE:
+            updates.append((index, delta))
+            index += index & -index
+        conn.executemany(
+            "INSERT INTO leaderboard_fenwick (idx, total) VALUES (?, ?) "
+            "ON CONFLICT(idx) DO UPDATE SET total = total + excluded.total",
+            updates
+        )
+
+    @staticmethod
+    def _fenwick_prefix(conn, index):
+        """バケット1〜indexの人数の合計"""
+        indexes = []
+        while index > 0:
+            indexes.append(index)
+            index -= index & -index
+        if not indexes:
+            return 0
+        placeholders = ', '.join('?' * len(indexes))
+        row = conn.execute(
+            f"SELECT COALESCE(SUM(total), 0) FROM leaderboard_fenwick WHERE idx IN ({placeholders})",
+            indexes
+        ).fetchone()
+        return row[0]
+
+    def record(self, nickname, score, seconds):
+        """クイズの結果を記録し、最高成績を更新した場合Trueを返す"""
+        now = time.time()
+        conn = self.store._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT best_score, best_seconds FROM leaderboard WHERE nickname = ?",
+                (nickname,)
+            ).fetchone()
+            if row and not _is_better(score, seconds, row[0], row[1]):
+                conn.execute(
+                    "UPDATE leaderboard SET attempts = attempts + 1 WHERE nickname = ?",
+                    (nickname,)
+                )
+                conn.commit()
+                return False
+
+            if row:
+                self._fenwick_add(conn, _bucket(row[0], row[1]), -1)
+            self._fenwick_add(conn, _bucket(score, seconds), 1)
+            conn.execute(
+                "INSERT INTO leaderboard (nickname, best_score, best_seconds, achieved_at, attempts) "
+                "VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT(nickname) DO UPDATE SET best_score = excluded.best_score, "
+                "best_seconds = excluded.best_seconds, achieved_at = excluded.achieved_at, "
+                "attempts = attempts + 1",
+                (nickname, score, seconds, now)
+            )
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+    def top(self, k=10):
+        """上位k件を返す（[{'rank', 'nickname', 'score', 'seconds'}, ...]）"""
+        with self.store._connect() as conn:
+            rows = conn.execute(
+                "SELECT nickname, best_score, best_seconds FROM leaderboard "
+                "ORDER BY best_score DESC, best_seconds ASC, nickname LIMIT ?",
+                (k,)
+            ).fetchall()
+            return [
+                {
+                    'rank': self._fenwick_prefix(conn, _bucket(score, seconds) - 1) + 1,
+                    'nickname': nickname,
+                    'score': score,
+                    'seconds': seconds,
+                }
+                for nickname, score, seconds in rows
+            ]
+
+    def rank_of(self, nickname):
+        """ユーザーの順位と参加者数を返す（未参加の場合None）
+
+        Returns:
+        --------
+        dict
+            rank（順位）, players（参加者数）, score（最高の正解数）, seconds（その所要時間）
+        """
+        with self.store._connect() as conn:
+            row = conn.execute(
+                "SELECT best_score, best_seconds FROM leaderboard WHERE nickname = ?",
+                (nickname,)
+            ).fetchone()
+            if not row:
+                return None
+            score, seconds = row
+            return {
+                'rank': self._fenwick_prefix(conn, _bucket(score, seconds) - 1) + 1,
+                'players': self._fenwick_prefix(conn, FENWICK_SIZE),
+                'score': score,
+                'seconds': seconds,
+            }
+
+
+def get_leaderboard():
+    """共有のセッションストアを使うリーダーボードを返す"""
+    return Leaderboard(get_session_store())
+
+
+def record_quiz_result(nickname, score, seconds):
+    """クイズの結果をリーダーボードに記録する（失敗してもクイズは続行する）"""
+    try:
+        return get_leaderboard().record(nickname, score, seconds)
+    except Exception as e:
+        print(f"リーダーボードの更新中にエラーが発生: {str(e)}")
+        return False
@@ -0,0 +1,229 @@
+import os
+import gzip
+import json
+import uuid
+import hashlib
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytz
+
+from .config import SPREADSHEET_ID, LOG_RETENTION_DAYS, LOG_ARCHIVE_DIR
+from .log_parser import parse_log_lines, LOG_COLUMNS, LOG_TIMEZONE
+
+MANIFEST_NAME = 'manifest.json'
+JP_TZ = pytz.timezone(LOG_TIMEZONE)
+
+
+def _line_hash(line):
+    return hashlib.sha256(line.encode('utf-8')).hexdigest()[:16]
+
+
+class LogArchive:
+    """保持期間を過ぎたログを日付ごとのgzip圧縮JSONLに保存するアーカイブ
+
+    ファイル構成:
+        {archive_dir}/manifest.json
+        {archive_dir}/date=2024-10-29/logs-{batch_id}.jsonl.gz
+
+    manifest.jsonには書き出したバッチごとに日付別のファイルと行数・期間を記録し、
+    検索時は指定した期間の日付のファイルだけを読み込む。
+    """
+    def __init__(self, archive_dir=LOG_ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        self.manifest_path = os.path.join(archive_dir, MANIFEST_NAME)
+
+    def load_manifest(self):
+        """マニフェストを読み込む（存在しない場合は空）"""
+        if not os.path.exists(self.manifest_path):
+            return {'version': 1, 'batches': []}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        # 書き込み途中のマニフェストを読まれないよう置き換えで反映
+        os.replace(tmp_path, self.manifest_path)
+
+    def manifest_version(self):
+        """マニフェストの更新時刻（検索結果のキャッシュキーに使う）"""
+        try:
+            return os.path.getmtime(self.manifest_path)
+        except OSError:
+            return 0.0
+
+    def write_batch(self, lines):
+        """ログ行を日付ごとのファイルに書き出し、マニフェストに記録したバッチを返す"""
+        df = parse_log_lines(lines)
+        df['line'] = list(lines)
+        # 時刻を解析できない行（複数行のメッセージなど）は直前の行と同じ日付に入れる
+        created_at = df['created_at'].ffill().bfill()
+        df['date'] = created_at.dt.strftime('%Y-%m-%d').fillna(datetime.now(JP_TZ).strftime('%Y-%m-%d'))
+
+        batch_id = f"{datetime.now(JP_TZ).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        partitions = []
+        for date, group in df.groupby('date', sort=True):
+            relative_path = os.path.join(f'date={date}', f'logs-{batch_id}.jsonl.gz')
+            path = os.path.join(self.archive_dir, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                for row in group.itertuples(index=False):
+                    f.write(json.dumps({
+                        'created_at': row.created_at.isoformat() if not pd.isna(row.created_at) else None,
+                        'user_id': row.user_id if not pd.isna(row.user_id) else None,
+                        'level': row.level if not pd.isna(row.level) else None,
+                        'line': row.line,
+                    }, ensure_ascii=False) + '\n')
+            partitions.append({
+                'date': date,
+                'path': relative_path,
+                'rows': len(group),
+                'first_at': group['created_at'].min().isoformat() if group['created_at'].notna().any() else None,
+                'last_at': group['created_at'].max().isoformat() if group['created_at'].notna().any() else None,
+            })
+
+        batch = {
+            'batch_id': batch_id,
+            'archived_at': datetime.now(JP_TZ).isoformat(),
+            'rows': len(lines),
+            'first_line_hash': _line_hash(lines[0]),
+            'last_line_hash': _line_hash(lines[-1]),
+            'live_deleted': False,
+            'partitions': partitions,
+        }
+        manifest = self.load_manifest()
+        manifest['batches'].append(batch)
+        self._save_manifest(manifest)
+        return batch
+
+    def mark_deleted(self, batch_id):
+        """バッチの行をライブのシートから削除済みとして記録"""
+        manifest = self.load_manifest()
+        for batch in manifest['batches']:
+            if batch['batch_id'] == batch_id:
+                batch['live_deleted'] = True
+        self._save_manifest(manifest)
+
+    def pending_batch(self):
+        """アーカイブ済みだがライブのシートから削除できていないバッチ（なければNone）"""
+        for batch in self.load_manifest()['batches']:
+            if not batch['live_deleted']:
+                return batch
+        return None
+
+    def partitions(self, start_date=None, end_date=None):
+        """期間に含まれる日付のファイルの一覧"""
+        for batch in self.load_manifest()['batches']:
+            for partition in batch['partitions']:
+                date = datetime.strptime(partition['date'], '%Y-%m-%d').date()
+                if start_date and date < start_date:
+                    continue
+                if end_date and date > end_date:
+                    continue
+                yield partition
+
+    def read_lines(self, start_date=None, end_date=None):
+        """期間に含まれる日付のファイルからログ行を順に返す"""
+        for partition in self.partitions(start_date, end_date):
+            with gzip.open(os.path.join(self.archive_dir, partition['path']), 'rt', encoding='utf-8') as f:
+                for record in f:
+                    yield json.loads(record)['line']
+
+    def query(self, start_date=None, end_date=None, user_id=None, level=None):
+        """アーカイブ済みのログを検索し、parse_log_linesと同じ形式のDataFrameで返す"""
+        df = parse_log_lines(list(self.read_lines(start_date, end_date)))
+        if df.empty:
+            return df
+        if user_id:
+            df = df[df['user_id'] == user_id]
+        if level:
+            df = df[df['level'] == level]
+        return df.sort_values('created_at', kind='stable')[LOG_COLUMNS]
+
+
+def _count_expired(lines, cutoff):
+    """先頭から連続する保持期間切れの行数（ログは時刻順に追記されている前提）"""
+    created_at = parse_log_lines(lines)['created_at'].ffill().bfill()
+    for index, value in enumerate(created_at):
+        if pd.isna(value) or value >= cutoff:
+            return index
+    return len(lines)
+
+
+def _delete_live_rows(handler, count):
+    """ライブのシートのヘッダー直後からcount行を削除"""
+    spreadsheet = handler.gsheet_connector.get(spreadsheetId=handler.spreadsheet_id).execute()
+    sheet_id = next(
+        sheet['properties']['sheetId'] for sheet in spreadsheet.get('sheets', [])
+        if sheet['properties']['title'] == handler.sheet_name
+    )
+    handler.gsheet_connector.batchUpdate(
+        spreadsheetId=handler.spreadsheet_id,
+        body={'requests': [{
+            'deleteDimension': {
+                'range': {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': 1, 'endIndex': 1 + count}
+            }
+        }]}
+    ).execute()
+
+
+def rotate_logs(spreadsheet_id=SPREADSHEET_ID, max_age_days=LOG_RETENTION_DAYS, archive=None, dry_run=False, now=None):
+    """ライブのログシートから保持期間を過ぎた行をアーカイブに移す
+
+    アーカイブへの書き出しとマニフェストの記録が終わってからシートの行を削除する。
+    削除に失敗した場合は次回の実行時に、同じ行を再度アーカイブせずに削除だけ行う。
+
+    Parameters:
+    -----------
+    max_age_days : int
+        シートに残す日数
+    dry_run : bool
+        Trueの場合は対象の行数を数えるだけで何も変更しない
+
+    Returns:
+    --------
+    dict
+        archived（アーカイブした行数）, deleted（シートから削除した行数）, remaining（残りの行数）
+    """
+    from .logger import GoogleSheetsHandler
+
+    archive = archive or LogArchive()
+    handler = GoogleSheetsHandler(spreadsheet_id)
+    result = handler.gsheet_connector.values().get(
+        spreadsheetId=spreadsheet_id,
+        range=f'{handler.sheet_name}!A:A'
+    ).execute()
+    lines = [row[0] if row else '' for row in result.get('values', [])[1:]]  # ヘッダーを除外
+    summary = {'archived': 0, 'deleted': 0, 'remaining': len(lines)}
+
+    pending = archive.pending_batch()
+    if pending is not None:
+        matches = (
+            len(lines) >= pending['rows']
+            and _line_hash(lines[0]) == pending['first_line_hash']
+            and _line_hash(lines[pending['rows'] - 1]) == pending['last_line_hash']
+        )
+        if not matches:
+            # 既にシートから削除されている（手動で削除された場合など）
+            if not dry_run:
+                archive.mark_deleted(pending['batch_id'])
+        else:
+            if not dry_run:
+                _delete_live_rows(handler, pending['rows'])
+                archive.mark_deleted(pending['batch_id'])
+            summary['deleted'] += pending['rows']
+            lines = lines[pending['rows']:]
+
+    cutoff = (now or datetime.now(JP_TZ)) - timedelta(days=max_age_days)
+    count = _count_expired(lines, cutoff) if lines else 0
+    if count and not dry_run:
+        batch = archive.write_batch(lines[:count])
+        _delete_live_rows(handler, count)
+        archive.mark_deleted(batch['batch_id'])
+    summary['archived'] += count
+    summary['deleted'] += count
+    summary['remaining'] = len(lines) - count
+    return summary
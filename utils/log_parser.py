@@ -0,0 +1,74 @@
+import io
+import re
+import pandas as pd
+
+# JSTFormatterの出力形式:
+#   2024-10-29 15:59:55 JST - xlsx_data_app_gpt - INFO - メッセージ
+LOG_LINE_PATTERN = re.compile(
+    r'^(?P<created_at>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \S+'
+    r' - (?P<logger_name>\S+)'
+    r' - (?P<level>[A-Z]+)'
+    r' - (?P<message>.*)$',
+    re.DOTALL
+)
+USER_ID_PATTERN = re.compile(r'ユーザー\[(?P<user_id>[^\]]*)\]')
+LOGGER_USER_PATTERN = re.compile(r'^xlsx_data_app_(?P<user_id>.+)$')
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_TIMEZONE = 'Asia/Tokyo'
+LOG_COLUMNS = ['created_at', 'user_id', 'level', 'logger_name', 'message']
+
+
+def parse_log_lines(lines):
+    """整形済みログ行を型付きの列を持つDataFrameに一括変換する
+
+    Parameters:
+    -----------
+    lines : list[str] or list[list[str]]
+        ログ行（get_logsが返す1列の行リストもそのまま渡せる）
+
+    Returns:
+    --------
+    pd.DataFrame
+        created_at（JSTのdatetime）, user_id, level, logger_name, message の列
+    """
+    raw = pd.Series(
+        [line[0] if isinstance(line, (list, tuple)) else line for line in lines],
+        dtype='string'
+    )
+    if raw.empty:
+        return pd.DataFrame({column: pd.Series(dtype='string') for column in LOG_COLUMNS})
+
+    df = raw.str.extract(LOG_LINE_PATTERN)
+
+    # 形式に合わない行はメッセージ全体として残す
+    df['message'] = df['message'].fillna(raw)
+
+    # 推測させずに固定フォーマットで解析する
+    df['created_at'] = pd.to_datetime(
+        df['created_at'], format=TIMESTAMP_FORMAT, errors='coerce'
+    ).dt.tz_localize(LOG_TIMEZONE)
+
+    # ユーザーIDはメッセージ中の「ユーザー[...]」、なければロガー名から取得
+    df['user_id'] = df['message'].str.extract(USER_ID_PATTERN)['user_id'].fillna(
+        df['logger_name'].str.extract(LOGGER_USER_PATTERN)['user_id']
+    )
+    df['level'] = df['level'].astype('category')
+
+    return df[LOG_COLUMNS]
+
+
+def iter_csv_chunks(df, chunk_size=50000):
+    """DataFrameをCSV文字列のチャンクとして順に返す"""
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size].to_csv(index=False, header=(start == 0))
+
+
+def to_csv_bytes(df, chunk_size=50000):
+    """チャンクごとにCSVを書き出してUTF-8のバイト列を返す"""
+    buffer = io.BytesIO()
+    # Excelで開いたときの文字化けを防ぐためBOMを付ける
+    buffer.write('\ufeff'.encode('utf-8'))
+    for chunk in iter_csv_chunks(df, chunk_size):
+        buffer.write(chunk.encode('utf-8'))
+    return buffer.getvalue()
@@ -0,0 +1,182 @@
+import re
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+from .metrics import inc
+from .log_parser import USER_ID_PATTERN
+
+# 送信先（シンク）の名前
+SHEETS_SINK = 'sheets'
+CONSOLE_SINK = 'console'
+
+# ルーティングの既定値
+ROUTE_DEFAULTS = {
+    'pattern': None,        # メッセージに対する正規表現（Noneは全て一致）
+    'min_level': logging.NOTSET,
+    'sinks': (SHEETS_SINK, CONSOLE_SINK),
+    'sample_rate': 1.0,     # リモートのシンクに送る割合
+    'max_length': None,     # リモートのシンクに送る最大文字数
+    'rate_limited': True,   # ユーザーごとのレート制限の対象にするか
+}
+
+# ルーティングのルール（上から順に評価し、最初に一致したものを使う）
+LOG_ROUTES = [
+    # 警告以上は間引かずに送る（長いスタックトレースは切り詰める）
+    {'name': 'problem', 'min_level': logging.WARNING, 'max_length': 2000},
+    # 管理画面の統計に使う回答イベントは必ず送る
+    {'name': 'answer', 'pattern': r' - (正解|不正解|回答記録) - ', 'rate_limited': False},
+    # 再実行のたびに出力される問題表示は一部だけ送る
+    {'name': 'question_view', 'pattern': r' - 問題表示 - ', 'sample_rate': 0.1, 'max_length': 300},
+    # GPT評価の経過はコンソールのみ
+    {'name': 'gpt_trace', 'pattern': r'^GPT(評価開始|評価キャッシュヒット|一括評価開始)', 'sinks': (CONSOLE_SINK,)},
+    # GPTの応答本文は先頭だけ送る
+    {'name': 'gpt_result', 'pattern': r'^GPT評価完了', 'max_length': 300},
+    {'name': 'default', 'max_length': 1000},
+]
+
+TRUNCATED_SUFFIX = '…（{omitted}文字省略）'
+
+# バックグラウンドのスレッドで出力したログをどのユーザーのものとして数えるか
+_thread_context = threading.local()
+
+
+@contextmanager
+def log_user_context(user_key):
+    """このスレッドで出力するログのレート制限の単位を指定する"""
+    previous = getattr(_thread_context, 'user_key', None)
+    _thread_context.user_key = user_key
+    try:
+        yield
+    finally:
+        _thread_context.user_key = previous
+
+
+class TokenBucket:
+    """トークンバケット（rate: 1秒あたりの補充数、capacity: 最大保持数）"""
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._clock = clock
+        self.updated_at = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def consume(self, amount=1):
+        """トークンを消費できればTrue"""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+def _session_key():
+    """実行中のStreamlitセッションのID（スクリプト実行スレッド以外ではNone）"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        return None
+    return ctx.session_id if ctx else None
+
+
+class LogRouter(logging.Filter):
+    """ルールに従ってログをシンクごとに振り分けるフィルタ
+
+    各ハンドラに自分のシンク名で追加する。リモートのシンクでは
+    サンプリングとユーザーごとのトークンバケットによるレート制限を行い、
+    送らなかったログはメトリクスのquiz_log_dropped_totalに数える。
+    長いメッセージの切り詰めはTruncatingFormatterが行う。
+
+    Parameters:
+    -----------
+    sink : str
+        このフィルタを追加するハンドラのシンク名
+    remote : bool
+        Sheetsなどクォータのあるシンクか（サンプリング・レート制限を行う）
+    rate_per_minute : float
+        ユーザーごとに1分あたり送信できるログ数
+    burst : int
+        ユーザーごとに連続して送信できるログ数
+    """
+    # これを超えたら満杯のバケット（しばらく使われていないユーザー）を削除する
+    MAX_BUCKETS = 1000
+
+    def __init__(self, sink, remote=False, rate_per_minute=30, burst=20, routes=None):
+        super().__init__()
+        self.sink = sink
+        self.remote = remote
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.routes = []
+        for route in (routes or LOG_ROUTES):
+            route = dict(ROUTE_DEFAULTS, **route)
+            if route['pattern'] is not None:
+                route['pattern'] = re.compile(route['pattern'])
+            self.routes.append(route)
+        self._buckets = {}
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def match(self, record):
+        """ログレコードに一致するルールを返す"""
+        message = record.getMessage()
+        for route in self.routes:
+            if record.levelno < route['min_level']:
+                continue
+            if route['pattern'] is not None and not route['pattern'].search(message):
+                continue
+            return route
+        return dict(ROUTE_DEFAULTS, name='default')
+
+    def _user_key(self, record):
+        """レート制限の単位（指定されたユーザー、セッションID、メッセージ中のユーザーIDの順）"""
+        user_key = getattr(_thread_context, 'user_key', None)
+        if user_key:
+            return user_key
+        session_key = _session_key()
+        if session_key:
+            return session_key
+        match = USER_ID_PATTERN.search(record.getMessage())
+        return match.group(1) if match else 'system'
+
+    def _allow(self, user_key):
+        with self._lock:
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.is_full()}
+            bucket = self._buckets.get(user_key)
+            if bucket is None:
+                bucket = self._buckets[user_key] = TokenBucket(self.rate_per_minute / 60, self.burst)
+            return bucket.consume()
+
+    def filter(self, record):
+        route = self.match(record)
+        if self.sink not in route['sinks']:
+            return False
+
+        if self.remote:
+            if route['sample_rate'] < 1.0:
+                with self._lock:
+                    sampled = self._random.random() < route['sample_rate']
+                if not sampled:
+                    inc('quiz_log_dropped_total', sink=self.sink, route=route['name'], reason='sampled')
+                    return False
+            if route['rate_limited'] and not self._allow(self._user_key(record)):
+                inc('quiz_log_dropped_total', sink=self.sink, route=route['name'], reason='rate_limited')
+                return False
+            inc('quiz_log_sent_total', sink=self.sink, route=route['name'])
+
+        # 切り詰めはシンクごとにフォーマッタで行う（レコードは全ハンドラで共有されるため）
+        setattr(record, f'{self.sink}_max_length', route['max_length'])
+        return True
@@ -11,8 +11,13 @@ import json
 from datetime import datetime
 import pytz
 import time
+import uuid
+import threading
 import streamlit as st
-from .config import SPREADSHEET_ID
+from .config import SPREADSHEET_ID, SHARED_STATE, LOG_RATE_PER_MINUTE, LOG_BURST
+from .session_store import get_session_store
+from .metrics import span
+from .log_routing import LogRouter, SHEETS_SINK, CONSOLE_SINK, TRUNCATED_SUFFIX
 
 SCOPE = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -23,6 +28,9 @@ JP_TZ = pytz.timezone('Asia/Tokyo')
 # グローバル変数としてloggerを定義
 logger = None
 
+# 共有モードでのログ送信スレッド（プロセスごとに1つ）
+_queue_flusher = None
+
 class JSTFormatter(logging.Formatter):
     """JSTタイムゾーンに対応したフォーマッタ"""
     def converter(self, timestamp):
@@ -40,6 +48,19 @@ class JSTFormatter(logging.Formatter):
         record.created = time.time()
         return super().format(record)
 
+class TruncatingFormatter(JSTFormatter):
+    """LogRouterがシンクごとに指定した最大文字数でログを切り詰めるフォーマッタ"""
+    def __init__(self, *args, sink=SHEETS_SINK, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sink = sink
+
+    def format(self, record):
+        message = super().format(record)
+        max_length = getattr(record, f'{self.sink}_max_length', None)
+        if max_length and len(message) > max_length:
+            message = message[:max_length] + TRUNCATED_SUFFIX.format(omitted=len(message) - max_length)
+        return message
+
 class JSTStreamHandler(logging.StreamHandler):
     """JSTに対応したStreamHandler"""
     def emit(self, record):
@@ -130,6 +151,7 @@ class GoogleSheetsHandler(logging.Handler):
             self.handleError(None)
             raise
 
+    @span('sheets.append')
     def add_row_to_gsheet(self, row_data):
         """Google Sheetsに1行のデータを追加"""
         try:
@@ -145,6 +167,24 @@ class GoogleSheetsHandler(logging.Handler):
             self.handleError(None)
             return False
 
+    @span('sheets.append_batch')
+    def add_rows_to_gsheet(self, rows):
+        """Google Sheetsに複数行のデータを1回のAPI呼び出しで追加"""
+        if not rows:
+            return True
+        try:
+            self.gsheet_connector.values().append(
+                spreadsheetId=self.spreadsheet_id,
+                range=f'{self.sheet_name}!A:A',
+                valueInputOption='USER_ENTERED',
+                body={'values': [[row] for row in rows]}
+            ).execute()
+            return True
+        except Exception as e:
+            print(f"複数行の追加中にエラーが発生: {str(e)}")
+            self.handleError(None)
+            return False
+
     def emit(self, record):
         """ログレコードをGoogle Sheetsに書き込む"""
         try:
@@ -154,6 +194,70 @@ class GoogleSheetsHandler(logging.Handler):
             print(f"Google Sheetsへのログ書き込み中にエラーが発生: {str(e)}")
             self.handleError(record)
 
+class SharedQueueHandler(logging.Handler):
+    """共有ストアのログキューにログを書き込むハンドラ
+
+    複数ワーカー構成では各ワーカーが直接Sheetsに書き込まず、
+    キューに積んだログをLogQueueFlusherがまとめて送信する。
+    """
+    def emit(self, record):
+        try:
+            get_session_store().enqueue_log(self.format(record))
+        except Exception as e:
+            print(f"ログキューへの書き込み中にエラーが発生: {str(e)}")
+            self.handleError(record)
+
+class LogQueueFlusher(threading.Thread):
+    """共有ログキューをGoogle Sheetsへまとめて送信するスレッド
+
+    全ワーカーで起動されるが、リースを保持しているワーカーだけが送信する。
+    """
+    LEASE_NAME = 'log_queue_flusher'
+
+    def __init__(self, spreadsheet_id, interval=5.0, batch_size=500):
+        super().__init__(daemon=True, name='LogQueueFlusher')
+        self.spreadsheet_id = spreadsheet_id
+        self.interval = interval
+        self.batch_size = batch_size
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._sheets_handler = None
+
+    def flush_once(self):
+        """リースを保持していればキューの先頭を1バッチ送信する（送信件数を返す）"""
+        store = get_session_store()
+        if not store.acquire_lease(self.LEASE_NAME, self.owner, ttl=self.interval * 6):
+            return 0
+
+        rows = store.peek_logs(self.batch_size)
+        if not rows:
+            return 0
+
+        if self._sheets_handler is None:
+            self._sheets_handler = GoogleSheetsHandler(self.spreadsheet_id)
+        if self._sheets_handler.add_rows_to_gsheet([message for _, message in rows]):
+            store.delete_logs_up_to(rows[-1][0])
+            return len(rows)
+        return 0
+
+    def run(self):
+        while True:
+            try:
+                # バッチが満杯の間は待たずに続けて送信
+                while self.flush_once() >= self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"ログキューの送信中にエラーが発生: {str(e)}")
+            time.sleep(self.interval)
+
+def start_queue_flusher(spreadsheet_id=SPREADSHEET_ID):
+    """ログキュー送信スレッドを起動（起動済みの場合は何もしない）"""
+    global _queue_flusher
+
+    if _queue_flusher is None:
+        _queue_flusher = LogQueueFlusher(spreadsheet_id)
+        _queue_flusher.start()
+    return _queue_flusher
+
 def setup_logger(
     spreadsheet_id=SPREADSHEET_ID,
     log_level=logging.INFO,
@@ -173,22 +277,32 @@ def setup_logger(
     logger.handlers.clear()
     
     try:
-        # Google Sheetsハンドラの設定
-        sheets_handler = GoogleSheetsHandler(spreadsheet_id)
+        # Google Sheetsハンドラの設定（共有モードではキュー経由で送信）
+        if SHARED_STATE:
+            sheets_handler = SharedQueueHandler()
+            start_queue_flusher(spreadsheet_id)
+        else:
+            sheets_handler = GoogleSheetsHandler(spreadsheet_id)
         sheets_handler.setLevel(log_level)
         
         # コンソールハンドラの設定
         console_handler = JSTStreamHandler()
         console_handler.setLevel(log_level)
         
-        # フォーマッタの設定
-        formatter = JSTFormatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S %Z'
-        )
-        
-        sheets_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
+        # フォーマッタの設定（Sheetsにはルールで指定した長さまで送る）
+        log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        datefmt = '%Y-%m-%d %H:%M:%S %Z'
+        sheets_handler.setFormatter(TruncatingFormatter(log_format, datefmt=datefmt, sink=SHEETS_SINK))
+        console_handler.setFormatter(JSTFormatter(log_format, datefmt=datefmt))
+
+        # イベントの種類とレベルで送信先を振り分け、Sheetsへの送信量を制限する
+        sheets_handler.addFilter(LogRouter(
+            SHEETS_SINK,
+            remote=True,
+            rate_per_minute=LOG_RATE_PER_MINUTE,
+            burst=LOG_BURST
+        ))
+        console_handler.addFilter(LogRouter(CONSOLE_SINK))
         
         logger.addHandler(sheets_handler)
         logger.addHandler(console_handler)
@@ -205,6 +319,7 @@ def setup_logger(
         print(f"ログ設定中にエラーが発生しました: {str(e)}")
         raise
 
+@span('sheets.get_logs')
 def get_logs(
     spreadsheet_id,
     user_id=None,
@@ -0,0 +1,288 @@
+import os
+import time
+import bisect
+import asyncio
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ヒストグラムのバケット境界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+SPAN_METRIC = 'quiz_span_duration_seconds'
+SPAN_ERRORS_METRIC = 'quiz_span_errors_total'
+
+# グローバル変数としてメトリクスサーバーと定期書き出しのスレッドを定義
+_server = None
+_server_attempted = False
+_server_lock = threading.Lock()
+_dump_thread = None
+_dump_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=None):
+    items = list(label_key) + list((extra or {}).items())
+    if not items:
+        return ''
+    body = ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in items)
+    return '{' + body + '}'
+
+
+class Counter:
+    """単調増加するカウンタ"""
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, value=1):
+        self.value += value
+
+
+class Histogram:
+    """固定バケットのヒストグラム"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最後は+Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """バケット内を線形補間してパーセンタイルを推定"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """プロセス内のカウンタとヒストグラムを保持するレジストリ"""
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series.setdefault(_label_key(labels), Counter()).inc(value)
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            series.setdefault(_label_key(labels), Histogram()).observe(value)
+
+    def snapshot(self):
+        """表示用に現在の値をリストで返す"""
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(key), 'value': counter.value}
+                for name, series in self._counters.items()
+                for key, counter in series.items()
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(key),
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'p50': histogram.quantile(0.50),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                }
+                for name, series in self._histograms.items()
+                for key, histogram in series.items()
+            ]
+        return counters, histograms
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式で出力"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} counter')
+                for key, counter in sorted(series.items()):
+                    lines.append(f'{name}{_format_labels(key)} {counter.value}')
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{_format_labels(key, {"le": bound})} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key, {"le": "+Inf"})} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+# プロセス全体で共有するレジストリ
+registry = MetricsRegistry()
+registry.describe(SPAN_METRIC, 'Duration of instrumented operations in seconds.')
+registry.describe(SPAN_ERRORS_METRIC, 'Number of instrumented operations that raised an exception.')
+
+
+def inc(name, value=1, **labels):
+    """カウンタを加算"""
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """ヒストグラムに値を記録"""
+    registry.observe(name, value, **labels)
+
+
+class span:
+    """処理時間を計測するスパン（コンテキストマネージャ・デコレータ兼用）
+
+    使い方:
+        with span('gpt.evaluate'):
+            ...
+
+        @span('sheets.append')
+        def add_row(...):
+            ...
+    """
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        registry.observe(SPAN_METRIC, elapsed, span=self.name, **self.labels)
+        # st.rerun()などの制御フロー用の例外はエラーとして数えない
+        if exc_type is not None and issubclass(exc_type, Exception) and exc_type.__name__ not in ('RerunException', 'StopException'):
+            registry.inc(SPAN_ERRORS_METRIC, span=self.name, **self.labels)
+        return False
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(self.name, **self.labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name, **self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def render_prometheus():
+    """現在のメトリクスをPrometheusのテキスト形式で返す"""
+    return registry.render_prometheus()
+
+
+def dump_metrics(path):
+    """現在のメトリクスをファイルに書き出す（node_exporterのtextfile collector向け）"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    # 書き込み途中のファイルを読まれないよう置き換えで反映
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない
+        pass
+
+
+def start_metrics_server(port, address='127.0.0.1'):
+    """/metricsを返すHTTPサーバーを起動（起動済みの場合は何もしない）
+
+    ポートを使えなかった場合もスクリプトの実行ごとに再試行せず、プロセスで一度だけ試みる。
+    """
+    global _server, _server_attempted
+
+    with _server_lock:
+        if _server_attempted:
+            return _server
+        _server_attempted = True
+        try:
+            _server = ThreadingHTTPServer((address, port), _MetricsHandler)
+        except OSError as e:
+            print(f"メトリクスサーバーの起動に失敗: {str(e)}")
+            return None
+        thread = threading.Thread(target=_server.serve_forever, daemon=True, name='MetricsServer')
+        thread.start()
+    return _server
+
+
+def start_metrics_dump(path, interval=15.0):
+    """メトリクスをinterval秒ごとにファイルへ書き出すスレッドを起動（起動済みの場合は何もしない）
+
+    複数のワーカープロセスで同じファイルを上書きしないよう、pathの{pid}はプロセスIDに置き換える。
+    """
+    global _dump_thread
+
+    with _dump_lock:
+        if _dump_thread is not None:
+            return _dump_thread
+        path = path.replace('{pid}', str(os.getpid()))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        def run():
+            while True:
+                try:
+                    dump_metrics(path)
+                except Exception as e:
+                    print(f"メトリクスの書き出し中にエラーが発生: {str(e)}")
+                time.sleep(interval)
+
+        _dump_thread = threading.Thread(target=run, daemon=True, name='MetricsDump')
+        _dump_thread.start()
+    return _dump_thread
@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+import types
+import logging
+import threading
+import tracemalloc
+
+import pandas as pd
+import streamlit as st
+
+from .config import SESSION_IDLE_SECONDS, SESSION_SWEEP_SECONDS
+from .metrics import inc
+from .session_store import save_progress, restore_progress, reset_quiz_state
+
+# 退避するセッション状態のキーと、退避後に入れる空の値
+# （quiz_dfは次の実行で読み込み直し、それ以外は進捗のスナップショットから戻す）
+EVICTED_KEYS = {
+    'quiz_df': lambda: None,
+    'answers_history': dict,
+    'quiz_results': lambda: None,
+    'correct_answers': dict,
+    'exam_answers': dict,
+}
+
+# セッションIDごとの最後のスクリプト実行の時刻と、退避とスクリプト実行の開始を排他するロック
+_last_seen = {}
+_session_locks = {}
+_last_sweep = 0.0
+_lock = threading.Lock()
+
+
+def estimate_size(obj, seen=None):
+    """オブジェクトが参照しているものを含めたおおよそのメモリ使用量（バイト）
+
+    seenに数えたオブジェクトのidを記録し、同じオブジェクトを二重に数えない。
+    ロガー・モジュール・クラス・関数はプロセス全体で共有されるため数えない。
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(obj, (logging.Logger, types.ModuleType, type, types.FunctionType)):
+        return 0
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += estimate_size(vars(obj), seen)
+    return size
+
+
+def _session_lock(session_id):
+    with _lock:
+        lock = _session_locks.get(session_id)
+        if lock is None:
+            lock = _session_locks[session_id] = threading.Lock()
+        return lock
+
+
+def touch_session():
+    """実行中のセッションの最終操作時刻を記録し、履歴が退避されていればスナップショットから読み戻す
+
+    退避（sweep_idle_sessions）と同じセッションごとのロックの中で行うため、
+    退避の途中の状態でスクリプトの実行が始まることはない。
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        restore_evicted_session()
+        return
+
+    with _session_lock(ctx.session_id):
+        with _lock:
+            _last_seen[ctx.session_id] = time.time()
+        restore_evicted_session()
+
+
+def _list_sessions():
+    """このプロセスのセッションの一覧（[(セッションID, SessionState), ...]）"""
+    from streamlit.runtime import Runtime
+
+    if not Runtime.exists():
+        return []
+    # 他のセッションの状態を取得する公開APIがないため、ランタイムのセッションマネージャから取得する
+    # （AppTestのランタイムなど、セッションマネージャを持たない場合は空）
+    session_mgr = getattr(Runtime.instance(), '_session_mgr', None)
+    if session_mgr is None:
+        return []
+    return [(info.session.id, info.session.session_state) for info in session_mgr.list_sessions()]
+
+
+def session_footprints():
+    """セッションごとのおおよそのメモリ使用量（使用量の多い順）
+
+    Returns:
+    --------
+    list of dict
+        session_id, nickname, screen, idle_seconds（最後の操作からの秒数）,
+        evicted（履歴を退避済みか）, total_bytes, sizes（キーごとのバイト数）
+    """
+    now = time.time()
+    footprints = []
+    for session_id, state in _list_sessions():
+        try:
+            values = state.filtered_state
+            # 同じオブジェクト（quiz_resultsの中のanswers_historyなど）はセッション内で一度だけ数える
+            seen = set()
+            sizes = {key: estimate_size(value, seen) for key, value in values.items()}
+        except Exception as e:
+            # スクリプトの実行中に状態が変わった場合は次回に回す
+            print(f"セッションのメモリ使用量の計測中にエラーが発生: {str(e)}")
+            continue
+        with _lock:
+            last_seen = _last_seen.get(session_id)
+        footprints.append({
+            'session_id': session_id,
+            'nickname': values.get('nickname'),
+            'screen': values.get('screen'),
+            'idle_seconds': now - last_seen if last_seen else None,
+            'evicted': bool(values.get('evicted_at')),
+            'total_bytes': sum(sizes.values()),
+            'sizes': sizes,
+        })
+    return sorted(footprints, key=lambda f: f['total_bytes'], reverse=True)
+
+
+def process_memory():
+    """プロセスのメモリ使用量（rss: 常駐メモリ、traced: tracemalloc有効時の確保量。取得できない場合None）"""
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        rss = None
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    return {'rss': rss, 'traced': traced}
+
+
+def evict_session(state):
+    """セッションの履歴を進捗のスナップショットに保存してからメモリから削除する（削除した場合True）
+
+    ログイン前のセッションは問題データの参照だけを削除する。
+    """
+    values = state.filtered_state
+    if values.get('evicted_at'):
+        return False
+
+    nickname = values.get('nickname')
+    keys = [key for key in EVICTED_KEYS if values.get(key) is not None and (nickname or key == 'quiz_df')]
+    if not keys:
+        return False
+    # 保存できなかった履歴は失われるため削除しない
+    if nickname and not save_progress(nickname, session_state=values):
+        return False
+
+    # 退避済みの印を先に付けてから削除する
+    if nickname:
+        state['evicted_at'] = time.time()
+    for key in keys:
+        state[key] = EVICTED_KEYS[key]()
+    inc('quiz_sessions_evicted_total')
+    return True
+
+
+def sweep_idle_sessions(idle_seconds=SESSION_IDLE_SECONDS):
+    """操作がないままidle_seconds秒を過ぎたセッションの履歴を退避し、退避した数を返す"""
+    now = time.time()
+    evicted = 0
+    live_ids = set()
+    for session_id, state in _list_sessions():
+        live_ids.add(session_id)
+        # スクリプトの実行開始（touch_session）と排他し、ロックの中で最終操作時刻を確認し直す。
+        # 操作がないセッションのスクリプトは実行中でないため、別のスレッドから状態を書き換えられる
+        with _session_lock(session_id):
+            with _lock:
+                # このプロセスで一度も実行されていないセッションは、ここから時間を数える
+                last_seen = _last_seen.setdefault(session_id, now)
+            if time.time() - last_seen < idle_seconds:
+                continue
+            try:
+                if evict_session(state):
+                    evicted += 1
+            except Exception as e:
+                print(f"セッションの退避中にエラーが発生: {str(e)}")
+
+    with _lock:
+        for session_id in list(_last_seen):
+            if session_id not in live_ids:
+                del _last_seen[session_id]
+                _session_locks.pop(session_id, None)
+    return evicted
+
+
+def maybe_sweep_idle_sessions():
+    """前回の確認からSESSION_SWEEP_SECONDS秒を過ぎていればアイドルセッションを退避する"""
+    global _last_sweep
+
+    with _lock:
+        if time.time() - _last_sweep < SESSION_SWEEP_SECONDS:
+            return 0
+        _last_sweep = time.time()
+    return sweep_idle_sessions()
+
+
+def restore_evicted_session():
+    """実行中のセッションの履歴が退避されていれば、スナップショットから読み戻す
+
+    スナップショットが削除されていた場合（別のタブでやり直した場合など）は、
+    途中の状態を残さないようクイズを最初から始める。
+    """
+    if not st.session_state.get('evicted_at'):
+        return False
+
+    del st.session_state['evicted_at']
+    if restore_progress(st.session_state.nickname):
+        inc('quiz_sessions_restored_total')
+        return True
+
+    print(f"退避した進捗が見つからないためクイズを初期化します: {st.session_state.nickname}")
+    reset_quiz_state()
+    return False
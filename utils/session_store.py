@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import streamlit as st
+from .config import STATE_DB_PATH
+
+# 進捗のスナップショット対象となるセッション状態のキー
+SNAPSHOT_KEYS = [
+    'screen',
+    'question_index',
+    'total_attempted',
+    'answered_questions',
+    'correct_answers',
+    'answers_history',
+    'quiz_results',
+    'exam_mode',
+    'exam_answers',
+    'pending_evaluation',
+    'quiz_started_at',
+]
+
+# グローバル変数としてストアを定義
+_store = None
+_store_lock = threading.Lock()
+
+
+def _int_keys(mapping):
+    """JSONで文字列化された問題番号のキーを整数に戻す"""
+    return {int(k): v for k, v in (mapping or {}).items()}
+
+
+class SessionStore:
+    """クイズの進捗・GPT評価結果・ログキュー・ランキングをSQLiteに保存するストア
+
+    SQLiteのファイルロックとWALモードにより、同じファイルを指す
+    複数のStreamlitワーカープロセスから安全に共有できる。
+    """
+    def __init__(self, db_path=STATE_DB_PATH):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._setup_tables()
+
+    def _connect(self):
+        """呼び出しごとに新しい接続を作成（スレッド間で共有しない）"""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _setup_tables(self):
+        """テーブルの作成"""
+        with self._connect() as conn:
+            # 読み取りと書き込みを並行させるためWALモードを使用
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS session_snapshots (
+                    nickname TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS evaluation_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    user_answer TEXT NOT NULL,
+                    profile TEXT NOT NULL DEFAULT '',
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            # プロファイル列がない古いファイルに列を追加する（既存の行はキーが一致しないため再評価される）
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(evaluation_cache)")]
+            if 'profile' not in columns:
+                conn.execute("ALTER TABLE evaluation_cache ADD COLUMN profile TEXT NOT NULL DEFAULT ''")
+            # 縮退モードで同じ問題の評価済みの解説を探すためのインデックス
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_evaluation_cache_question "
+                "ON evaluation_cache (question, created_at)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS log_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leaderboard (
+                    nickname TEXT PRIMARY KEY,
+                    best_score INTEGER NOT NULL,
+                    best_seconds REAL NOT NULL,
+                    achieved_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL
+                )
+            """)
+            # ランキングの上位をテーブルを読まずにインデックスだけで返すためのカバリングインデックス
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_leaderboard_rank "
+                "ON leaderboard (best_score DESC, best_seconds ASC, nickname, achieved_at)"
+            )
+            # 成績のバケットごとの人数を持つフェニック木（utils/leaderboard.py）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leaderboard_fenwick (
+                    idx INTEGER PRIMARY KEY,
+                    total INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def save_snapshot(self, nickname, state):
+        """ユーザーの進捗を保存"""
+        payload = json.dumps(state, ensure_ascii=False)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_snapshots (nickname, state, updated_at) VALUES (?, ?, ?)",
+                (nickname, payload, time.time())
+            )
+
+    def load_snapshot(self, nickname):
+        """ユーザーの進捗を読み込む（存在しない場合はNone）"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT state FROM session_snapshots WHERE nickname = ?",
+                (nickname,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete_snapshot(self, nickname):
+        """ユーザーの進捗を削除"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM session_snapshots WHERE nickname = ?", (nickname,))
+
+    @staticmethod
+    def evaluation_key(question, options, user_answer, profile):
+        """評価キャッシュのキーを生成（モデルや採点方法が違う評価を共有しないようプロファイル名を含める）"""
+        raw = json.dumps([question, list(options), user_answer, profile], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_evaluation(self, question, options, user_answer, profile):
+        """キャッシュ済みのGPT評価を取得（存在しない場合はNone）"""
+        key = self.evaluation_key(question, options, user_answer, profile)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response FROM evaluation_cache WHERE cache_key = ?",
+                (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_evaluation(self, question, options, user_answer, profile, response):
+        """GPT評価をキャッシュに保存"""
+        key = self.evaluation_key(question, options, user_answer, profile)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO evaluation_cache "
+                "(cache_key, question, user_answer, profile, response, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, question, user_answer, profile, response, time.time())
+            )
+
+    def get_latest_evaluation(self, question, is_correct, user_answer=None):
+        """同じ問題で正誤の判定が同じ最新のGPT評価を取得（存在しない場合はNone）
+
+        user_answerを渡すと、同じ回答の評価があればそれを優先する。
+        """
+        marker = 'RESULT:[CORRECT]' if is_correct else 'RESULT:[INCORRECT]'
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response FROM evaluation_cache WHERE question = ? AND instr(response, ?) > 0 "
+                "ORDER BY user_answer = ? DESC, created_at DESC LIMIT 1",
+                (question, marker, user_answer)
+            ).fetchone()
+        return row[0] if row else None
+
+    def enqueue_log(self, message):
+        """ログ行を共有キューに追加"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO log_queue (message, created_at) VALUES (?, ?)",
+                (message, time.time())
+            )
+
+    def peek_logs(self, limit=500):
+        """キューの先頭からログ行を取得（[(id, message), ...]）"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT id, message FROM log_queue ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+
+    def delete_logs_up_to(self, last_id):
+        """送信済みのログ行をキューから削除"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM log_queue WHERE id <= ?", (last_id,))
+
+    def acquire_lease(self, name, owner, ttl=30):
+        """名前付きリースを取得・更新する（取得できた場合True）
+
+        全ワーカーのうち1つだけがログ送信などの処理を担当するために使う。
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT owner, expires_at FROM leases WHERE name = ?",
+                (name,)
+            ).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                conn.rollback()
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, owner, now + ttl)
+            )
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+    def release_lease(self, name, owner):
+        """保持しているリースを解放する"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+def get_session_store():
+    """ストアのインスタンスを返す（DBファイルはワーカー間で共有される）"""
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(STATE_DB_PATH)
+    return _store
+
+
+def save_progress(nickname=None, session_state=None):
+    """現在のセッション状態をスナップショットとして保存
+
+    session_stateを指定した場合は、実行中のセッションの代わりにその状態（dict）を保存する。
+    """
+    source = st.session_state if session_state is None else session_state
+    nickname = nickname or source.get('nickname')
+    if not nickname:
+        return False
+
+    state = {key: source.get(key) for key in SNAPSHOT_KEYS}
+    state['answered_questions'] = sorted(state['answered_questions'] or [])
+
+    try:
+        get_session_store().save_snapshot(nickname, state)
+        return True
+    except Exception as e:
+        print(f"進捗の保存中にエラーが発生: {str(e)}")
+        return False
+
+
+def restore_progress(nickname):
+    """保存済みの進捗をセッション状態に復元する（復元できた場合True）"""
+    try:
+        state = get_session_store().load_snapshot(nickname)
+    except Exception as e:
+        print(f"進捗の読み込み中にエラーが発生: {str(e)}")
+        return False
+
+    if not state:
+        return False
+
+    st.session_state.screen = state.get('screen') or 'quiz'
+    st.session_state.question_index = state.get('question_index', 0)
+    st.session_state.total_attempted = state.get('total_attempted', 0)
+    st.session_state.answered_questions = set(state.get('answered_questions') or [])
+    st.session_state.correct_answers = _int_keys(state.get('correct_answers'))
+    st.session_state.answers_history = _int_keys(state.get('answers_history'))
+    st.session_state.exam_mode = bool(state.get('exam_mode'))
+    st.session_state.exam_answers = _int_keys(state.get('exam_answers'))
+    # 評価待ちの回答はジョブが残っていれば結果を受け取り、なければ再投入する
+    st.session_state.pending_evaluation = state.get('pending_evaluation')
+    st.session_state.quiz_started_at = state.get('quiz_started_at')
+
+    quiz_results = state.get('quiz_results')
+    if quiz_results:
+        quiz_results['answers_history'] = _int_keys(quiz_results.get('answers_history'))
+    st.session_state.quiz_results = quiz_results
+    return True
+
+
+def reset_quiz_state():
+    """クイズの進捗に関するセッション状態を初期値に戻す（保存済みの進捗は変更しない）"""
+    initial_state = {
+        'screen': 'quiz',
+        'question_index': 0,
+        'total_attempted': 0,
+        'answered_questions': set(),
+        'correct_answers': {},
+        'answers_history': {},
+        'exam_answers': {},
+        'pending_evaluation': None,
+        'quiz_started_at': None,
+        'quiz_results': None
+    }
+
+    for key, value in initial_state.items():
+        st.session_state[key] = value
+
+
+def clear_progress(nickname=None):
+    """保存済みの進捗を削除"""
+    nickname = nickname or st.session_state.get('nickname')
+    if not nickname:
+        return
+
+    try:
+        get_session_store().delete_snapshot(nickname)
+    except Exception as e:
+        print(f"進捗の削除中にエラーが発生: {str(e)}")